@@ -0,0 +1,202 @@
+"""
+REMC Analytics
+Portfolio totals, pipeline value and overdue jobs over columnar project numerics
+
+Quote values, start/completion epochs and status/division codes are kept as
+parallel NumPy arrays and aggregated with bincount/cumsum.
+"""
+
+import calendar
+import math
+import threading
+from array import array
+from datetime import date
+
+import numpy as np
+
+from project_index import parse_date, parse_value
+from store import COMPLETED_STATUSES
+
+UNKNOWN = 'Unknown'
+
+
+def _timeline(value):
+    """(epoch seconds, month number) of a date, or (NaN, -1) when missing or invalid"""
+    iso_date = parse_date(value)
+    if iso_date is None:
+        return math.nan, -1
+    try:
+        day = date.fromisoformat(iso_date)
+    except ValueError:
+        return math.nan, -1
+    return float(calendar.timegm(day.timetuple())), day.year * 12 + day.month - 1
+
+
+def _month_label(number):
+    return f'{number // 12:04d}-{number % 12 + 1:02d}'
+
+
+def _histogram(codes, size, weights=None):
+    """Count (or sum of weights) per code in range(size); negative codes are skipped"""
+    keep = codes >= 0
+    return np.bincount(codes[keep], weights=None if weights is None else weights[keep], minlength=size)
+
+
+def _shifted(months, first, valid=None):
+    """Month numbers as offsets from first, -1 where the month is missing (or valid is false)"""
+    keep = months >= 0 if valid is None else valid & (months >= 0)
+    return np.where(keep, months - first, -1)
+
+
+class PortfolioColumns:
+    """Project numerics as parallel NumPy columns, one row per project"""
+
+    def __init__(self, projects):
+        self.statuses = []
+        self.divisions = []
+        status_codes, division_codes = {}, {}
+        quote, start, completion = array('d'), array('d'), array('d')
+        start_month, completion_month = array('i'), array('i')
+        status, division = array('i'), array('i')
+
+        for project in projects:
+            value = parse_value(project.get('quote_value'))
+            quote.append(math.nan if value is None else value)
+            epoch, month = _timeline(project.get('start_date'))
+            start.append(epoch)
+            start_month.append(month)
+            epoch, month = _timeline(project.get('completion_date'))
+            completion.append(epoch)
+            completion_month.append(month)
+
+            # Statuses group case-insensitively under their first spelling, as in the project index
+            label = str(project.get('status') or '').strip() or UNKNOWN
+            code = status_codes.get(label.lower())
+            if code is None:
+                code = status_codes[label.lower()] = len(self.statuses)
+                self.statuses.append(label)
+            status.append(code)
+
+            label = str(project.get('type') or '').strip() or UNKNOWN
+            code = division_codes.get(label)
+            if code is None:
+                code = division_codes[label] = len(self.divisions)
+                self.divisions.append(label)
+            division.append(code)
+
+        self.completed_codes = [code for key, code in status_codes.items() if key in COMPLETED_STATUSES]
+        self.size = len(quote)
+        self.quote = np.asarray(quote)
+        # Jobs without a quote still count, but add nothing to value totals
+        self.value = np.nan_to_num(self.quote, nan=0.0)
+        self.start = np.asarray(start)
+        self.completion = np.asarray(completion)
+        self.start_month = np.asarray(start_month)
+        self.completion_month = np.asarray(completion_month)
+        self.status = np.asarray(status)
+        self.division = np.asarray(division)
+
+    def grouped(self, codes, labels):
+        """{label: {count, value}} for a code column, leaving out empty groups"""
+        counts = _histogram(codes, len(labels))
+        values = _histogram(codes, len(labels), self.value)
+        return {label: {'count': int(count), 'value': round(float(value), 2)}
+                for label, count, value in zip(labels, counts, values) if count}
+
+    def by_month(self):
+        """{YYYY-MM: {count, value}} of jobs by start month"""
+        months = self.start_month[self.start_month >= 0]
+        if not len(months):
+            return {}
+        first, last = int(months.min()), int(months.max())
+        labels = [_month_label(month) for month in range(first, last + 1)]
+        return self.grouped(_shifted(self.start_month, first), labels)
+
+    def pipeline(self):
+        """Jobs and quoted value in progress each month, from the first start to the last completion
+
+        A job is in progress from its start month through its completion month; a
+        job without a completion date stays in the pipeline.
+        """
+        starts, ends = self.start_month, self.completion_month
+        started = starts >= 0
+        if not started.any():
+            return []
+        first = int(starts[started].min())
+        last = int(max(starts.max(), ends.max()))
+        size = last - first + 1
+        finishing = started & (ends >= 0)
+        # A job leaves the month after it completes, and never before it starts
+        entering = _shifted(starts, first)
+        leaving = _shifted(np.maximum(ends, starts), first - 1, finishing)
+
+        # One extra bucket for jobs leaving after the last month
+        open_jobs = np.cumsum(_histogram(entering, size + 1) - _histogram(leaving, size + 1))
+        open_value = np.cumsum(_histogram(entering, size + 1, self.value) - _histogram(leaving, size + 1, self.value))
+        return [{'month': _month_label(first + i), 'jobs': int(open_jobs[i]), 'value': round(float(open_value[i]), 2)}
+                for i in range(size)]
+
+    def overdue(self, now):
+        """Jobs whose completion date is before now but are not marked completed"""
+        late = (self.completion < now) & ~np.isin(self.status, self.completed_codes)
+        return {
+            'count': int(late.sum()),
+            'value': round(float(self.value[late].sum()), 2),
+            'by_division': self.grouped(np.where(late, self.division, -1), self.divisions),
+        }
+
+    def summary(self, now):
+        total = float(self.value.sum())
+        quoted = int((~np.isnan(self.quote)).sum())
+        return {
+            'totals': {
+                'count': self.size,
+                'quoted': quoted,
+                'value': round(total, 2),
+                'average_value': round(total / quoted, 2) if quoted else None,
+            },
+            'by_status': self.grouped(self.status, self.statuses),
+            'by_division': self.grouped(self.division, self.divisions),
+            'by_month': self.by_month(),
+            'pipeline': self.pipeline(),
+            'overdue': self.overdue(now),
+        }
+
+
+class PortfolioAnalytics:
+    """Analytics summary cached per data version
+
+    The columns are rebuilt only when the data version changes; the summary also
+    depends on the day, since that decides which jobs are overdue.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._columns = None
+        self._summary = None
+        self.builds = 0
+        self.hits = 0
+
+    def summary(self, data_version, load_projects, today=None):
+        """Summary for data_version; load_projects() is called only when the columns need rebuilding"""
+        key = (data_version, today or date.today())
+        cached = self._summary
+        if cached is not None and cached[0] == key:
+            self.hits += 1
+            return cached[1]
+        with self._lock:
+            if self._summary is not None and self._summary[0] == key:
+                self.hits += 1
+                return self._summary[1]
+            if self._columns is None or self._columns[0] != data_version:
+                self._columns = (data_version, PortfolioColumns(load_projects()))
+                self.builds += 1
+            # Overdue means due before the start of today
+            now = float(calendar.timegm(key[1].timetuple()))
+            result = dict(self._columns[1].summary(now), as_of=key[1].isoformat())
+            self._summary = (key, result)
+            return result
+
+    def stats(self):
+        return {'builds': self.builds, 'hits': self.hits}
+
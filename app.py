@@ -5,168 +5,382 @@ A web-based version of the REMC project management system
 Compatible with iOS, Android, and desktop browsers
 """
 
-from flask import Flask, render_template, request, jsonify, send_file, redirect, url_for, session
-import json
+from flask import Flask, render_template, request, jsonify, send_file, redirect, url_for
 import os
 import sys
-from datetime import datetime, timedelta
-import sqlite3
+from datetime import datetime
 from werkzeug.utils import secure_filename
-import hashlib
+import hmac
+import mimetypes
 import secrets
+import threading
+from functools import wraps
+from urllib.parse import urlencode
+
+from analytics import PortfolioAnalytics
+from assets import AssetPipeline, compress_response
+from blobstore import BlobStore
+from http_cache import RenderCache, build_id, conditional, http_datetime, make_etag
+from journal import Journal
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Metrics
+from project_index import SORT_FIELDS, ProjectQuery
+from profiler import SamplingProfiler
+from sqlite_store import SQLiteEmailStore, SQLiteProjectStore, SQLiteSource, SQLiteStorage
+from store import EmailStore, FileBackedStore, ProjectStore, refresh_all
+from uploads import DiskUpload, IngestPool, UploadRequest, find_project_id
+from watcher import DataWatcher
 
 # Add parent directory to path to import existing modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 app = Flask(__name__)
 app.secret_key = secrets.token_hex(16)
+# Multipart files are streamed into UPLOAD_FOLDER rather than buffered in memory
+app.request_class = UploadRequest
+
+# Request latency and per-phase timings, exposed at /metrics
+request_metrics = Metrics()
+request_metrics.init_app(app)
 
 # Configuration
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'doc', 'docx', 'xls', 'xlsx'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.config['ALLOWED_EXTENSIONS'] = ALLOWED_EXTENSIONS
+# Per shared file, and for a whole share request (e.g. 20 site photos at once)
+app.config['MAX_FILE_SIZE'] = int(os.environ.get('REMC_MAX_FILE_MB', 50)) * 1024 * 1024
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('REMC_MAX_UPLOAD_MB', 500)) * 1024 * 1024
+EMAILS_PAGE_SIZE = 50
+MAX_EMAILS_PAGE_SIZE = 200
+PROJECT_TYPES = ('Residential', 'Commercial')
+# The write journal is folded into the JSON files once it grows past this
+JOURNAL_COMPACT_BYTES = int(os.environ.get('REMC_JOURNAL_COMPACT_KB', 1024)) * 1024
+# Shared secret for the write API, sent as "Authorization: Bearer <token>"; the API is disabled when unset
+API_TOKEN = os.environ.get('REMC_API_TOKEN', '')
 
 # Ensure upload folder exists
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 class REMCWebManager:
     def __init__(self):
-        self.data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
-        self.base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        # REMC_BASE_DIR points at another directory holding the data files (defaults to the app's parent)
+        self.base_dir = os.environ.get('REMC_BASE_DIR') or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.data_dir = os.path.join(self.base_dir, 'data')
+        residential_file = os.path.join(self.base_dir, 'residential_data.json')
+        app_data_file = os.path.join(self.base_dir, 'app_data.json')
+        email_file = os.path.join(self.base_dir, 'email_tracking.json')
         
-    def load_projects(self):
-        """Load all projects from JSON files"""
-        projects = []
+        # REMC_STORAGE=sqlite serves from a SQLite database imported from the JSON files
+        if os.environ.get('REMC_STORAGE', 'json') == 'sqlite':
+            storage = SQLiteStorage(os.environ.get('REMC_DB_PATH', os.path.join(self.base_dir, 'remc.db')))
+            # Imported now if the JSON files changed since the last import, then by the import watcher
+            # whenever the tracker changes them
+            self.sqlite_source = SQLiteSource(storage, residential_file, app_data_file, email_file)
+            self.sqlite_source.refresh()
+            if os.environ.get('REMC_WATCH', '1') == '0':
+                print("Warning: REMC_WATCH=0 with REMC_STORAGE=sqlite: changes to the JSON files "
+                      "are only imported when the app restarts")
+            self.project_store = SQLiteProjectStore(storage)
+            self.email_store = SQLiteEmailStore(storage)
+            self.journal = None
+            if API_TOKEN:
+                # Writes are journaled over the JSON files, and the database is imported from those
+                raise RuntimeError('REMC_API_TOKEN enables the write API, which needs REMC_STORAGE=json')
+        else:
+            # Changes made in the app are appended here and replayed over the JSON files
+            self.sqlite_source = None
+            self.journal = Journal(os.environ.get('REMC_JOURNAL', os.path.join(self.base_dir, 'remc_journal.jsonl')))
+            self.project_store = ProjectStore(residential_file, app_data_file, self.journal)
+            self.email_store = EmailStore(email_file, self.journal)
+        self._compacting = threading.Lock()
+        self.analytics = PortfolioAnalytics()
         
-        # Load residential projects
+    def file_stores(self):
+        """The stores backed by JSON files (none with the SQLite backend)"""
+        return [store for store in (self.project_store, self.email_store) if isinstance(store, FileBackedStore)]
+    
+    def shared_sources(self):
+        """What one process keeps current for all of them: the JSON files behind the SQLite database"""
+        return [self.sqlite_source] if self.sqlite_source is not None else []
+    
+    def preload(self):
+        """Parse all data files now rather than on the first request"""
+        if self.journal is not None and self.journal.size() >= JOURNAL_COMPACT_BYTES:
+            self.compact_journal()
+        refresh_all(self.file_stores())
+        self.project_store.query_index()
+        self.get_analytics()
+        if self.sqlite_source is not None:
+            # serve.py forks the workers next, and a SQLite connection must not cross a fork
+            self.sqlite_source.storage.close()
+    
+    def compact_journal(self):
+        """Fold the journal into fresh JSON files; returns the number of entries folded"""
+        def fold(entries):
+            for store in self.file_stores():
+                store.fold(entries)
         try:
-            residential_file = os.path.join(self.base_dir, 'residential_data.json')
-            if os.path.exists(residential_file):
-                with open(residential_file, 'r') as f:
-                    residential_data = json.load(f)
-                    # Handle both list and dict formats
-                    if isinstance(residential_data, dict):
-                        for project_id, project in residential_data.items():
-                            if isinstance(project, dict):
-                                project['id'] = project_id
-                                project['type'] = 'Residential'
-                                projects.append(project)
-                    elif isinstance(residential_data, list):
-                        for i, project in enumerate(residential_data):
-                            if isinstance(project, dict):
-                                project['id'] = project.get('id', f'RES-{i+1}')
-                                project['type'] = 'Residential'
-                                projects.append(project)
+            return self.journal.compact(fold)
         except Exception as e:
-            print(f"Error loading residential data: {e}")
-        
-        # Load commercial projects
+            print(f"Error compacting journal: {e}")
+            return None
+    
+    def _compact_in_background(self):
         try:
-            app_data_file = os.path.join(self.base_dir, 'app_data.json')
-            if os.path.exists(app_data_file):
-                with open(app_data_file, 'r') as f:
-                    app_data = json.load(f)
-                    commercial_projects = app_data.get('projects', {})
-                    for project_id, project in commercial_projects.items():
-                        if isinstance(project, dict):
-                            project['id'] = project_id
-                            project['type'] = 'Commercial'
-                            projects.append(project)
-        except Exception as e:
-            print(f"Error loading commercial data: {e}")
-            
-        return projects
+            self.compact_journal()
+        finally:
+            self._compacting.release()
+    
+    def _write(self, store, make_entry):
+        """Durably record a change and apply it to store, so it is visible as soon as this returns
+        
+        make_entry() runs under the journal lock with store up to date (including
+        writes from other worker processes), so it can safely check and allocate ids.
+        """
+        with self.journal.locked():
+            store.refresh()
+            entry = make_entry()
+            entry['at'] = datetime.now().isoformat(timespec='seconds')
+            self.journal.write(entry)
+        store.refresh()
+        if self.journal.size() >= JOURNAL_COMPACT_BYTES and self._compacting.acquire(blocking=False):
+            threading.Thread(target=self._compact_in_background, name='remc-compact', daemon=True).start()
+    
+    def _next_project_id(self, project_type):
+        """Next free id of the form R12 / C7"""
+        prefix = project_type[0]
+        numbers = [int(project_id[1:]) for project_id in self.project_store.snapshot().by_id
+                   if project_id[:1] == prefix and project_id[1:].isdigit()]
+        return f'{prefix}{max(numbers, default=0) + 1}'
     
+    def create_project(self, project_type, fields, project_id=None):
+        """Add a project and return it; raises ValueError if project_id is taken"""
+        def entry():
+            nonlocal project_id
+            if project_id is None:
+                project_id = self._next_project_id(project_type)
+            elif self.project_store.get(project_id) is not None:
+                raise ValueError(f'Project {project_id} already exists')
+            return {'op': 'project', 'id': project_id, 'type': project_type, 'fields': fields}
+        self._write(self.project_store, entry)
+        return self.project_store.get(project_id)
+    
+    def update_project(self, project, fields):
+        """Change some fields of a project and return the updated project"""
+        self._write(self.project_store,
+                    lambda: {'op': 'project', 'id': project['id'], 'type': project['type'], 'fields': fields})
+        return self.project_store.get(project['id'])
+    
+    def tag_email(self, email_id, project_id):
+        """Track an email against a project (None clears it) and return the updated email"""
+        self._write(self.email_store, lambda: {'op': 'tag', 'email_id': email_id, 'project_id': project_id})
+        return self.email_store.get(email_id)
+    
+    @request_metrics.timed('load')
+    def load_projects(self):
+        """Load all projects from JSON files"""
+        return self.project_store.all()
+    
+    @request_metrics.timed('load')
+    def get_project(self, project_id):
+        """Look up a single project by id"""
+        return self.project_store.get(project_id)
+    
+    @request_metrics.timed('load')
     def load_email_tracking(self):
         """Load email tracking data"""
-        try:
-            email_file = os.path.join(self.base_dir, 'email_tracking.json')
-            if os.path.exists(email_file):
-                with open(email_file, 'r') as f:
-                    data = json.load(f)
-                    # Handle both list and dict formats
-                    if isinstance(data, list):
-                        # Convert list to dict with index as key
-                        return {str(i): email for i, email in enumerate(data)}
-                    return data
-        except Exception as e:
-            print(f"Error loading email tracking: {e}")
-        return {}
+        return self.email_store.all()
     
+    @request_metrics.timed('load')
     def get_project_stats(self):
         """Get dashboard statistics"""
-        projects = self.load_projects()
-        emails = self.load_email_tracking()
+        counts = self.project_store.counts()
         
         stats = {
-            'total_projects': len(projects),
-            'active_projects': len([p for p in projects if p.get('status', '').lower() in ['active', 'in progress', 'ongoing']]),
-            'completed_projects': len([p for p in projects if p.get('status', '').lower() in ['completed', 'finished']]),
-            'total_emails': len(emails),
-            'recent_emails': len([e for e in emails.values() if self._is_recent(e.get('received_time', ''))]),
-            'residential_projects': len([p for p in projects if p.get('type') == 'Residential']),
-            'commercial_projects': len([p for p in projects if p.get('type') == 'Commercial'])
+            'total_projects': counts['total_projects'],
+            'active_projects': counts['active_projects'],
+            'completed_projects': counts['completed_projects'],
+            'total_emails': self.email_store.count(),
+            'recent_emails': self.email_store.recent_count(),
+            'residential_projects': counts['residential_projects'],
+            'commercial_projects': counts['commercial_projects']
         }
         return stats
     
-    def _is_recent(self, date_str):
-        """Check if date is within last 7 days"""
-        try:
-            if not date_str:
-                return False
-            # Handle different date formats
-            for fmt in ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d', '%d/%m/%Y %H:%M:%S', '%d/%m/%Y']:
-                try:
-                    date_obj = datetime.strptime(date_str, fmt)
-                    return (datetime.now() - date_obj).days <= 7
-                except ValueError:
-                    continue
-            return False
-        except:
-            return False
-    
-    def search_projects(self, query):
+    @request_metrics.timed('search')
+    def search_projects(self, query, limit=None):
         """Search projects by name, ID, or description"""
-        projects = self.load_projects()
-        if not query:
-            return projects
-        
-        query = query.lower()
-        filtered = []
-        
-        for project in projects:
-            # Search in project ID, name, description, client
-            searchable_fields = [
-                project.get('id', ''),
-                project.get('name', ''),
-                project.get('description', ''),
-                project.get('client', ''),
-                project.get('location', '')
-            ]
-            
-            if any(query in str(field).lower() for field in searchable_fields):
-                filtered.append(project)
-        
-        return filtered
+        return self.project_store.search(query, limit)
     
+    @request_metrics.timed('search')
+    def query_projects(self, query):
+        """Get one page of filtered, sorted projects: (projects, next_cursor, total)"""
+        return self.project_store.query(query)
+    
+    @request_metrics.timed('load')
+    def get_analytics(self):
+        """Portfolio totals, pipeline and overdue jobs, rebuilt only when the project data changes"""
+        return self.analytics.summary(self.project_store.data_version(), self.project_store.all)
+    
+    @request_metrics.timed('load')
+    def get_email_page(self, cursor=None, limit=50):
+        """Get one page of emails (most recent first) and the cursor for the next page"""
+        return self.email_store.page(cursor, limit)
+    
+    @request_metrics.timed('load')
     def get_project_emails(self, project_id):
         """Get all emails for a specific project"""
-        emails = self.load_email_tracking()
-        project_emails = []
-        
-        for email_id, email in emails.items():
-            if email.get('tracked_project_id') == project_id:
-                email['id'] = email_id
-                project_emails.append(email)
-        
-        # Sort by received time (most recent first)
-        project_emails.sort(key=lambda x: x.get('received_time', ''), reverse=True)
-        return project_emails
+        return self.email_store.for_project(project_id)
 
 # Initialize manager
 remc_manager = REMCWebManager()
 
+# Reload the JSON files in the background when they change. Until a process starts its watcher (and with
+# REMC_WATCH=0) the stores check the files' signatures on each request instead
+data_watcher = None
+# Re-imports the SQLite database when the JSON files change, in one process for all of them
+import_watcher = None
+_watcher_lock = threading.Lock()
+
+def _start_watcher(watcher, sources):
+    """The running watcher if it belongs to this process, else a newly started one over sources"""
+    if watcher is not None and watcher.pid == os.getpid():
+        return watcher
+    watcher = DataWatcher(sources, interval=float(os.environ.get('REMC_WATCH_INTERVAL', 2)))
+    watcher.start()
+    return watcher
+
+def start_data_watcher():
+    """Start this process's watcher thread, at startup rather than on a request
+    
+    serve.py calls it in each worker after the fork, since threads don't survive one.
+    """
+    global data_watcher
+    if os.environ.get('REMC_WATCH', '1') == '0':
+        return
+    with _watcher_lock:
+        data_watcher = _start_watcher(data_watcher, remc_manager.file_stores())
+
+def start_import_watcher():
+    """Start the SQLite import watcher; serve.py calls it once in the parent, not in every worker"""
+    global import_watcher
+    if os.environ.get('REMC_WATCH', '1') == '0':
+        return
+    with _watcher_lock:
+        import_watcher = _start_watcher(import_watcher, remc_manager.shared_sources())
+
+# REMC_PROFILE=path samples all threads and writes collapsed stacks there ({pid} is replaced per process)
+profiler = None
+
+@app.before_request
+def start_profiler():
+    """Start the sampling profiler on the first request of each process when enabled"""
+    global profiler
+    profile_path = os.environ.get('REMC_PROFILE')
+    if not profile_path or (profiler is not None and profiler.pid == os.getpid()):
+        return
+    with _watcher_lock:
+        if profiler is None or profiler.pid != os.getpid():
+            sampler = SamplingProfiler(profile_path.replace('{pid}', str(os.getpid())),
+                                       interval=float(os.environ.get('REMC_PROFILE_INTERVAL_MS', 5)) / 1000)
+            sampler.start()
+            profiler = sampler
+
+# Shared files and email attachments, stored once per distinct content
+blob_store = BlobStore(os.environ.get('REMC_BLOB_DIR', os.path.join(UPLOAD_FOLDER, 'blobs')))
+# Directories email attachments may be imported from (os.pathsep-separated); the data and upload folders by default
+ATTACHMENT_ROOTS = [os.path.realpath(root) for root in
+                    (os.environ.get('REMC_ATTACHMENT_ROOTS') or os.pathsep.join([remc_manager.data_dir, UPLOAD_FOLDER]))
+                    .split(os.pathsep) if root]
+# Behind nginx / Apache, REMC_X_SENDFILE=1 lets the web server send blobs itself
+app.config['USE_X_SENDFILE'] = os.environ.get('REMC_X_SENDFILE') == '1'
+
+# Hashing, type checks and project linking for shared files run off the request thread
+ingest_pool = IngestPool(UPLOAD_FOLDER, blob_store, workers=int(os.environ.get('REMC_INGEST_WORKERS', 2)),
+                         find_project=lambda texts: find_project_id(texts, remc_manager.get_project))
+
+# Changes whenever the code or templates are redeployed
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+BUILD_ID = build_id([os.path.join(APP_DIR, 'app.py')] + [
+    os.path.join(APP_DIR, 'templates', name) for name in os.listdir(os.path.join(APP_DIR, 'templates'))
+])
+
+# Rendered pages and JSON bodies, reused while the data version is unchanged
+render_cache = RenderCache(max_bytes=int(os.environ.get('REMC_RENDER_CACHE_MB', 32)) * 1024 * 1024)
+
+# Static files, hashed and precompressed once at startup (before any worker fork)
+assets = AssetPipeline(os.path.join(APP_DIR, 'static')).build()
+# Compressed copies of dynamic responses, keyed on URL, ETag and encoding
+compressed_cache = RenderCache(max_bytes=int(os.environ.get('REMC_COMPRESSED_CACHE_MB', 8)) * 1024 * 1024)
+COMPRESS_MIN_BYTES = int(os.environ.get('REMC_COMPRESS_MIN_BYTES', 1024))
+
+@app.context_processor
+def inject_asset_url():
+    """asset_url('name') in templates gives the content-hashed, immutable URL of a static file"""
+    return {'asset_url': assets.url}
+
+def current_data_version():
+    """Version of everything a cached page depends on: the code, templates and both stores"""
+    return make_etag(BUILD_ID, remc_manager.project_store.data_version(), remc_manager.email_store.data_version())
+
+@app.after_request
+def add_data_version(response):
+    """Tell clients (the service worker) which data version a response was built from"""
+    try:
+        response.headers['X-REMC-Data-Version'] = current_data_version()
+    except Exception as e:
+        print(f"Error reading data version: {e}")
+    return response
+
+@app.after_request
+def compress(response):
+    """Gzip / brotli dynamic responses above COMPRESS_MIN_BYTES"""
+    return compress_response(response, COMPRESS_MIN_BYTES, compressed_cache)
+
+def serve_static(filename):
+    """Static files from the asset pipeline; hashed names are cached forever"""
+    asset, immutable = assets.lookup(filename)
+    if asset is None:
+        return 'Not found', 404
+    return assets.response(asset, immutable)
+
+app.view_functions['static'] = serve_static
+
+def data_validated(*store_names, recent=False, daily=False):
+    """Conditional GET keyed on the data versions of the named stores
+    
+    Pass recent=True for responses that show the time-dependent recent email count,
+    and daily=True for ones that depend on today's date.
+    """
+    def validators():
+        stores = [getattr(remc_manager, name) for name in store_names]
+        parts = [BUILD_ID] + [store.data_version() for store in stores]
+        if recent:
+            parts.append(remc_manager.email_store.recent_count())
+        if daily:
+            parts.append(datetime.now().date().isoformat())
+        mtimes = [mtime for mtime in (store.last_modified() for store in stores) if mtime is not None]
+        return make_etag(*parts), http_datetime(max(mtimes) if mtimes else None)
+    return conditional(validators, cache=render_cache)
+
+def api_token_required(view):
+    """Require the REMC_API_TOKEN bearer token; the write API answers 403 when no token is configured
+    
+    The token is sent in a header, never a cookie, so other sites cannot make a
+    browser send it (which rules out CSRF).
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not API_TOKEN:
+            return jsonify({'error': 'The write API is disabled; set REMC_API_TOKEN to enable it'}), 403
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not hmac.compare_digest(token.strip().encode(), API_TOKEN.encode()):
+            return jsonify({'error': 'Invalid or missing API token'}), 401, {'WWW-Authenticate': 'Bearer'}
+        return view(*args, **kwargs)
+    return wrapper
+
 @app.route('/')
+@data_validated('project_store', 'email_store', recent=True)
 def index():
     """Main dashboard"""
     stats = remc_manager.get_project_stats()
@@ -174,17 +388,41 @@ def index():
     return render_template('dashboard.html', stats=stats, recent_projects=recent_projects)
 
 @app.route('/projects')
+@data_validated('project_store')
 def projects():
-    """Projects page with search"""
-    search_query = request.args.get('search', '')
-    projects_list = remc_manager.search_projects(search_query)
-    return render_template('projects.html', projects=projects_list, search_query=search_query)
+    """Projects page with search, filters, sorting and keyset paging"""
+    args = request.args.copy()
+    dropped = False
+    while True:
+        try:
+            query = ProjectQuery.from_args(args, search_param='search')
+            projects_list, next_cursor, total = remc_manager.query_projects(query)
+            break
+        except ValueError as e:
+            # Drop only the malformed parameter (or a cursor that doesn't fit the query) and keep the other filters
+            param = getattr(e, 'param', 'cursor')
+            if param not in args:
+                return jsonify({'error': str(e)}), 400
+            args.poplist(param)
+            dropped = True
+    
+    # The query string is re-encoded rather than passed to url_for(), which treats _anchor, _external etc. specially
+    base_url = url_for('projects')
+    if dropped:
+        return redirect(f"{base_url}?{urlencode(list(args.items(multi=True)))}" if args else base_url)
+    filters = [(key, value) for key, value in args.items(multi=True) if key != 'cursor']
+    next_url = f"{base_url}?{urlencode(filters + [('cursor', next_cursor)])}" if next_cursor else None
+    first_url = (f"{base_url}?{urlencode(filters)}" if filters else base_url) if query.cursor else None
+    return render_template('projects.html', projects=projects_list, search_query=query.search, total=total,
+                           next_url=next_url, first_url=first_url,
+                           filters=request.args, statuses=remc_manager.project_store.query_index().statuses,
+                           sort_fields=SORT_FIELDS)
 
 @app.route('/project/<project_id>')
+@data_validated('project_store', 'email_store')
 def project_detail(project_id):
     """Project detail page with emails"""
-    projects = remc_manager.load_projects()
-    project = next((p for p in projects if p['id'] == project_id), None)
+    project = remc_manager.get_project(project_id)
     
     if not project:
         return redirect(url_for('projects'))
@@ -193,29 +431,99 @@ def project_detail(project_id):
     return render_template('project_detail.html', project=project, emails=project_emails)
 
 @app.route('/emails')
+@data_validated('email_store', recent=True)
 def emails():
-    """Email tracking page"""
-    emails = remc_manager.load_email_tracking()
-    email_list = []
+    """Email tracking page (first page; more are loaded from /api/emails)"""
+    cursor = request.args.get('cursor', '')
+    try:
+        email_list, next_cursor = remc_manager.get_email_page(cursor, EMAILS_PAGE_SIZE)
+    except ValueError:
+        return redirect(url_for('emails'))
     
-    for email_id, email in emails.items():
-        email['id'] = email_id
-        email_list.append(email)
+    overview = remc_manager.email_store.overview()
+    return render_template('emails.html', emails=email_list, next_cursor=next_cursor,
+                           total_emails=overview['total_emails'],
+                           with_attachments=overview['with_attachments'],
+                           project_ids=overview['project_ids'],
+                           recent_emails=remc_manager.email_store.recent_count(),
+                           change_seq=remc_manager.email_store.changes_since()['seq'])
+
+def email_summary(email):
+    """Lightweight email fields for list views (no body or attachment contents)"""
+    return {
+        'id': email['id'],
+        'subject': email.get('subject', ''),
+        'sender': email.get('sender', ''),
+        'received_time': email.get('received_time', ''),
+        'tracked_project_id': email.get('tracked_project_id'),
+        'email_type': email.get('email_type', ''),
+        'attachment_count': len(email.get('attachments') or [])
+    }
+
+@app.route('/api/emails')
+@data_validated('email_store')
+def api_emails():
+    """API endpoint for paginated email summaries, most recent first"""
+    cursor = request.args.get('cursor', '')
+    limit = min(max(request.args.get('limit', EMAILS_PAGE_SIZE, type=int), 1), MAX_EMAILS_PAGE_SIZE)
+    try:
+        email_list, next_cursor = remc_manager.get_email_page(cursor, limit)
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
     
-    # Sort by received time (most recent first)
-    email_list.sort(key=lambda x: x.get('received_time', ''), reverse=True)
+    return jsonify({
+        'emails': [email_summary(email) for email in email_list],
+        'next_cursor': next_cursor
+    })
+
+@app.route('/api/emails/refresh')
+def api_emails_refresh():
+    """API endpoint for emails added, changed or removed since the client's last poll
+    
+    Clients pass the `seq` token from their previous response as ?since=, or an epoch
+    timestamp as ?since_time= to get every email received after it.
+    """
+    since_time = request.args.get('since_time', type=float)
+    if since_time is not None:
+        new_emails = remc_manager.email_store.received_after(since_time)
+        return jsonify({
+            'seq': remc_manager.email_store.changes_since()['seq'],
+            'reset': False,
+            'new_emails': len(new_emails),
+            'emails': [dict(email_summary(email), change='added') for email in new_emails],
+            'removed': []
+        })
     
-    return render_template('emails.html', emails=email_list)
+    delta = remc_manager.email_store.changes_since(request.args.get('since'))
+    changed_emails = [dict(email_summary(email), change='added') for email in delta['added']]
+    changed_emails += [dict(email_summary(email), change='changed') for email in delta['changed']]
+    return jsonify({
+        'seq': delta['seq'],
+        'reset': delta['reset'],
+        'new_emails': len(delta['added']),
+        'emails': changed_emails,
+        'removed': delta['removed']
+    })
+
+@app.route('/api/emails/<email_id>')
+@data_validated('email_store')
+def api_email_detail(email_id):
+    """API endpoint for a single email including body and attachments"""
+    email = remc_manager.email_store.get(email_id)
+    if not email:
+        return jsonify({'error': 'Email not found'}), 404
+    return jsonify(email.to_dict())
 
 @app.route('/api/projects/search')
+@data_validated('project_store')
 def api_search_projects():
     """API endpoint for project search (for mobile autocomplete)"""
     query = request.args.get('q', '')
-    projects = remc_manager.search_projects(query)
+    projects = remc_manager.search_projects(query, limit=10)
     
     # Return simplified project data for API
     simplified = []
-    for project in projects[:10]:  # Limit to 10 results
+    for project in projects:
         simplified.append({
             'id': project['id'],
             'name': project.get('name', ''),
@@ -226,12 +534,170 @@ def api_search_projects():
     
     return jsonify(simplified)
 
+@app.route('/api/projects/<project_id>')
+@data_validated('project_store')
+def api_project_detail(project_id):
+    """API endpoint for a single project"""
+    project = remc_manager.get_project(project_id)
+    if not project:
+        return jsonify({'error': 'Project not found'}), 404
+    return jsonify(project.to_dict())
+
+def project_fields(data):
+    """Fields to write from a project request body, or raise ValueError"""
+    if not isinstance(data, dict):
+        raise ValueError('Expected a JSON object of project fields')
+    fields = {key: value for key, value in data.items() if key not in ('id', 'type')}
+    if not all(isinstance(key, str) and key for key in fields):
+        raise ValueError('Field names must be non-empty strings')
+    if 'quote_value' in fields and fields['quote_value'] is not None:
+        try:
+            float(fields['quote_value'])
+        except (TypeError, ValueError):
+            raise ValueError('quote_value must be a number')
+    return fields
+
+@app.route('/api/projects')
+@data_validated('project_store')
+def api_projects():
+    """API endpoint for filtered, sorted project pages
+    
+    ?q=&status=&type=&min_value=&max_value=&start_from=&start_to=&completion_from=
+    &completion_to=&sort=-quote_value,name&limit=&cursor= (next_cursor of the previous page)
+    """
+    try:
+        query = ProjectQuery.from_args(request.args)
+        projects_list, next_cursor, total = remc_manager.query_projects(query)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({
+        'projects': [project.to_dict() for project in projects_list],
+        'next_cursor': next_cursor,
+        'total': total
+    })
+
+@app.route('/api/projects', methods=['POST'])
+@api_token_required
+def api_create_project():
+    """API endpoint to add a project; the body is a JSON object of fields, with optional id and type"""
+    data = request.get_json(silent=True)
+    try:
+        fields = project_fields(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    project_type = data.get('type', 'Residential')
+    if project_type not in PROJECT_TYPES:
+        return jsonify({'error': f"type must be one of {', '.join(PROJECT_TYPES)}"}), 400
+    if not fields.get('name'):
+        return jsonify({'error': 'name is required'}), 400
+    project_id = data.get('id')
+    if project_id is not None and (not isinstance(project_id, str) or not project_id.strip()):
+        return jsonify({'error': 'id must be a non-empty string'}), 400
+    
+    try:
+        project = remc_manager.create_project(project_type, fields, project_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+    response = jsonify(project.to_dict())
+    response.status_code = 201
+    response.headers['Location'] = url_for('api_project_detail', project_id=project['id'])
+    return response
+
+@app.route('/api/projects/<project_id>', methods=['PATCH'])
+@api_token_required
+def api_update_project(project_id):
+    """API endpoint to change some fields of a project"""
+    project = remc_manager.get_project(project_id)
+    if not project:
+        return jsonify({'error': 'Project not found'}), 404
+    data = request.get_json(silent=True)
+    try:
+        fields = project_fields(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if data.get('id', project_id) != project_id or data.get('type', project['type']) != project['type']:
+        return jsonify({'error': 'A project id or type cannot be changed'}), 400
+    
+    project = remc_manager.update_project(project, fields)
+    return jsonify(project.to_dict())
+
+@app.route('/api/emails/<email_id>/project', methods=['PUT'])
+@api_token_required
+def api_tag_email(email_id):
+    """API endpoint to track an email against a project: {"project_id": "R12"}, or null to clear it"""
+    if remc_manager.email_store.get(email_id) is None:
+        return jsonify({'error': 'Email not found'}), 404
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or 'project_id' not in data:
+        return jsonify({'error': 'Expected a JSON object with project_id'}), 400
+    project_id = data['project_id']
+    if project_id is not None and (not isinstance(project_id, str) or remc_manager.get_project(project_id) is None):
+        return jsonify({'error': 'Project not found'}), 400
+    
+    email = remc_manager.tag_email(email_id, project_id)
+    return jsonify(email_summary(email))
+
 @app.route('/api/stats')
+@data_validated('project_store', 'email_store', recent=True)
 def api_stats():
     """API endpoint for dashboard stats"""
     stats = remc_manager.get_project_stats()
     return jsonify(stats)
 
+@app.route('/api/analytics')
+@data_validated('project_store', daily=True)
+def api_analytics():
+    """API endpoint for portfolio totals by status, division and month, pipeline value and overdue jobs"""
+    return jsonify(remc_manager.get_analytics())
+
+@app.route('/api/cache/stats')
+def api_cache_stats():
+    """API endpoint for data store cache counters"""
+    return jsonify({
+        'projects': remc_manager.project_store.stats(),
+        'emails': remc_manager.email_store.stats(),
+        'render': render_cache.stats(),
+        'compressed': compressed_cache.stats(),
+        'analytics': remc_manager.analytics.stats(),
+        'watcher': data_watcher.stats() if data_watcher is not None else None,
+        'journal': remc_manager.journal.stats() if remc_manager.journal is not None else None
+    })
+
+@app.route('/healthz')
+def healthz():
+    """Health check for load balancers and process managers"""
+    try:
+        versions = {
+            'projects': remc_manager.project_store.data_version(),
+            'emails': remc_manager.email_store.data_version(),
+        }
+    except Exception as e:
+        print(f"Health check failed: {e}")
+        return jsonify({'status': 'error', 'error': str(e), 'pid': os.getpid()}), 503, {'Cache-Control': 'no-store'}
+    return jsonify({
+        'status': 'ok',
+        'pid': os.getpid(),
+        'data_versions': versions,
+        'watcher': data_watcher.stats() if data_watcher is not None else None
+    }), 200, {'Cache-Control': 'no-store'}
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics: request latency, phase timings and cache hit ratios"""
+    stores = {'projects': remc_manager.project_store, 'emails': remc_manager.email_store}
+    store_stats = {name: store.stats() for name, store in stores.items()}
+    caches = dict(store_stats, render=render_cache.stats(), compressed=compressed_cache.stats())
+    gauges = {
+        'remc_data_version': [({'store': name}, stats['version']) for name, stats in store_stats.items()],
+        'remc_data_reload_seconds': [({'store': name}, stats['reload_seconds'])
+                                     for name, stats in store_stats.items() if 'reload_seconds' in stats],
+        'remc_render_cache_bytes': [({}, caches['render']['bytes'])],
+    }
+    if profiler is not None:
+        gauges['remc_profiler_samples'] = [({}, profiler.samples)]
+    return request_metrics.render(caches, gauges), 200, {'Content-Type': METRICS_CONTENT_TYPE}
+
 @app.route('/settings')
 def settings():
     """Settings page"""
@@ -251,23 +717,111 @@ def install_page():
 def share_handler():
     """Handle shared content from PWA"""
     if request.method == 'POST':
-        # Handle shared files/data
+        # Handle shared files/data; the files are already on disk once the form is parsed
         title = request.form.get('title', '')
         text = request.form.get('text', '')
         url = request.form.get('url', '')
         files = request.files.getlist('files')
+        context = {'title': title, 'text': text, 'url': url}
         
-        # Process shared content (could save to projects)
-        print(f"Shared content: title={title}, text={text}, url={url}")
+        # Queue each file for processing and return straight away
+        accepted = []
+        rejected = []
         for file in files:
-            print(f"Shared file: {file.filename}")
+            if not file.filename:
+                continue
+            if isinstance(file.stream, DiskUpload):
+                accepted.append(ingest_pool.submit(file.stream, context))
+            else:
+                rejected.append(file.filename)
+        print(f"Shared content: title={title}, text={text}, url={url}, files={len(accepted)}, rejected={rejected}")
         
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify({'accepted': accepted, 'rejected': rejected}), 202
         # Redirect to main app
         return redirect(url_for('index'))
     
     # GET request - show share interface
     return render_template('share.html')
 
+@app.teardown_request
+def discard_unclaimed_uploads(exc):
+    """Remove partial uploads of requests that failed before their files were queued"""
+    if isinstance(request, UploadRequest):
+        request.discard_unclaimed_uploads()
+
+@app.route('/api/shared')
+def api_shared():
+    """API endpoint for recently shared files and the ingest queue"""
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+    files = ingest_pool.recent(limit)
+    for record in files:
+        record['url'] = url_for('download_blob', digest=record['sha256'], filename=record['filename'])
+    return jsonify({'files': files, 'queue': ingest_pool.stats(), 'blobs': blob_store.stats()})
+
+def attachment_source(path):
+    """Real path of an attachment's source file if it is inside one of ATTACHMENT_ROOTS, else None
+
+    Relative paths are taken from the data files' directory. Symlinks are resolved
+    first, so a link can't lead out of the allowed directories.
+    """
+    real_path = os.path.realpath(os.path.join(remc_manager.base_dir, path))
+    for root in ATTACHMENT_ROOTS:
+        try:
+            if os.path.commonpath([real_path, root]) == root:
+                return real_path
+        except ValueError:  # different drives on Windows
+            continue
+    return None
+
+def attachment_digest(attachment):
+    """Blob digest of an email attachment, importing it from its source path on first use"""
+    digest = attachment.get('sha256')
+    if digest and blob_store.has(digest):
+        return digest
+    path = attachment.get('path')
+    if path and isinstance(path, str):
+        source = attachment_source(path)
+        if source is None:
+            print(f"Refusing attachment outside the attachment directories: {path}")
+            return None
+        try:
+            return blob_store.import_path(source)
+        except OSError as e:
+            print(f"Error importing attachment {path}: {e}")
+    return None
+
+@app.route('/api/emails/<email_id>/attachments/<path:filename>')
+def email_attachment(email_id, filename):
+    """Redirect to the content-addressed download of an email attachment"""
+    email = remc_manager.email_store.get(email_id)
+    if not email:
+        return jsonify({'error': 'Email not found'}), 404
+    attachment = next((item for item in email.get('attachments') or []
+                       if hasattr(item, 'get') and item.get('filename') == filename), None)
+    digest = attachment_digest(attachment) if attachment else None
+    if digest is None:
+        return jsonify({'error': 'Attachment not available'}), 404
+    return redirect(url_for('download_blob', digest=digest, filename=filename, download=request.args.get('download')))
+
+@app.route('/blobs/<digest>')
+@app.route('/blobs/<digest>/<path:filename>')
+def download_blob(digest, filename=None):
+    """Serve a stored file by its SHA-256, with Range support; the content behind a URL never changes"""
+    if not blob_store.has(digest):
+        return jsonify({'error': 'File not found'}), 404
+    name = secure_filename(filename or '') or digest
+    # send_file uses the server's wsgi.file_wrapper (sendfile) or X-Sendfile when available
+    response = send_file(blob_store.path(digest),
+                         mimetype=mimetypes.guess_type(name)[0] or 'application/octet-stream',
+                         as_attachment=request.args.get('download') == '1',
+                         download_name=name, conditional=True, etag=digest, max_age=31536000)
+    # Advertised on full responses too, so clients know an interrupted download can resume
+    response.accept_ranges = 'bytes'
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
 @app.route('/offline')
 def offline_page():
     """Offline fallback page"""
@@ -276,23 +830,21 @@ def offline_page():
 @app.route('/static/manifest.json')
 def manifest():
     """PWA Manifest"""
-    response = send_file('static/manifest.json', mimetype='application/json')
-    response.headers['Cache-Control'] = 'no-cache'
-    return response
+    return serve_static('manifest.json')
 
 @app.route('/static/sw.js')
 def service_worker():
     """Service Worker"""
-    response = send_file('static/sw.js', mimetype='application/javascript')
-    response.headers['Cache-Control'] = 'no-cache'
+    # Kept at a fixed, revalidated URL: browsers look for updates at the URL it was registered with
+    response = serve_static('sw.js')
+    # Lets the worker registered from /static/ control the whole app
+    response.headers['Service-Worker-Allowed'] = '/'
     return response
 
 @app.route('/static/icon-192.svg')
 def app_icon():
     """App Icon"""
-    response = send_file('static/icon-192.svg', mimetype='image/svg+xml')
-    response.headers['Cache-Control'] = 'public, max-age=31536000'
-    return response
+    return serve_static('icon-192.svg')
 
 if __name__ == '__main__':
     # Get port from environment for Railway deployment
@@ -308,7 +860,17 @@ if __name__ == '__main__':
     print("For global access, use ngrok or Railway deployment")
     
     try:
-        app.run(host='0.0.0.0', port=port, debug=False)
+        # REMC_SERVE_MODE=production uses the pre-forking threaded server (see serve.py)
+        if os.environ.get('REMC_SERVE_MODE') == 'production':
+            from serve import serve
+            serve(app, '0.0.0.0', port,
+                  workers=int(os.environ.get('REMC_WORKERS', os.cpu_count() or 1)),
+                  threads=int(os.environ.get('REMC_THREADS', 8)),
+                  preload=remc_manager.preload, post_fork=start_data_watcher, supervise=start_import_watcher)
+        else:
+            start_data_watcher()
+            start_import_watcher()
+            app.run(host='0.0.0.0', port=port, debug=False)
     except Exception as e:
         print(f"Error starting server: {e}")
         print("Press any key to exit...")
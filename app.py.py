@@ -621,6 +621,11 @@ def api_projects():
     """API endpoint for projects data"""
     return jsonify(SAMPLE_PROJECTS)
 
+@app.route('/healthz')
+def healthz():
+    """Health check for load balancers and process managers"""
+    return jsonify({'status': 'ok', 'pid': os.getpid()}), 200, {'Cache-Control': 'no-store'}
+
 if __name__ == '__main__':
     print("🚀 Starting REMC Web Application...")
     port = int(os.environ.get('PORT', 5000))
@@ -631,4 +636,11 @@ if __name__ == '__main__':
     print(f"   - Projects: http://localhost:{port}/projects")
     print("✅ For mobile installation, use the /install URL")
     
-    app.run(host='0.0.0.0', port=port, debug=False)
\ No newline at end of file
+    # REMC_SERVE_MODE=production uses the pre-forking threaded server from serve.py when it is deployed alongside
+    if os.environ.get('REMC_SERVE_MODE') == 'production':
+        from serve import serve
+        serve(app, '0.0.0.0', port,
+              workers=int(os.environ.get('REMC_WORKERS', os.cpu_count() or 1)),
+              threads=int(os.environ.get('REMC_THREADS', 8)))
+    else:
+        app.run(host='0.0.0.0', port=port, debug=False)
\ No newline at end of file
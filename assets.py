@@ -0,0 +1,157 @@
+"""
+REMC Asset Pipeline
+Content-hashed, precompressed static files and on-the-fly compression of dynamic responses
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+
+from flask import make_response, request
+
+try:
+    import brotli
+except ImportError:  # optional; responses fall back to gzip
+    brotli = None
+
+# Server preference when the client accepts several encodings equally
+ENCODINGS = ('br', 'gzip', 'identity') if brotli is not None else ('gzip', 'identity')
+COMPRESSIBLE_TYPES = {
+    'text/html', 'text/plain', 'text/css', 'text/javascript', 'application/javascript',
+    'application/json', 'application/manifest+json', 'image/svg+xml',
+}
+IMMUTABLE = 'public, max-age=31536000, immutable'
+HASH_LENGTH = 10
+
+
+def _compress(body, encoding, static=False):
+    """Compress body; static assets are built once, so they get the slowest, smallest setting"""
+    if encoding == 'gzip':
+        # mtime=0 keeps the output (and so the cached copy) identical across rebuilds
+        return gzip.compress(body, compresslevel=9 if static else 6, mtime=0)
+    if encoding == 'br':
+        return brotli.compress(body, quality=11 if static else 5)
+    return body
+
+
+def _hashed_name(name, digest):
+    """'sw.js' -> 'sw.<digest>.js'"""
+    root, ext = os.path.splitext(name)
+    return f'{root}.{digest}{ext}'
+
+
+class Asset:
+    """One static file with its encoded variants"""
+
+    def __init__(self, name, body, content_type):
+        self.name = name
+        self.content_type = content_type
+        self.digest = hashlib.sha256(body).hexdigest()[:HASH_LENGTH]
+        self.hashed_name = _hashed_name(name, self.digest)
+        self.bodies = {'identity': body}
+        if content_type.split(';')[0] in COMPRESSIBLE_TYPES:
+            for encoding in ENCODINGS:
+                if encoding != 'identity':
+                    compressed = _compress(body, encoding, static=True)
+                    # Only keep variants that actually save something
+                    if len(compressed) < len(body):
+                        self.bodies[encoding] = compressed
+
+
+class AssetPipeline:
+    """Static files loaded at startup, addressable by plain or content-hashed name
+
+    Hashed names change whenever a file's content does, so they are served as
+    immutable; plain names stay revalidating for URLs that must not change
+    (the service worker script) or that are hard-coded elsewhere.
+    """
+
+    def __init__(self, static_dir):
+        self.static_dir = static_dir
+        self.assets = {}
+        self.hashed = {}
+
+    def build(self):
+        assets = {}
+        for directory, _, files in os.walk(self.static_dir):
+            for filename in files:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, self.static_dir).replace(os.sep, '/')
+                content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+                if content_type.startswith('text/') or content_type.endswith(('javascript', 'json', 'xml')):
+                    content_type += '; charset=utf-8'
+                try:
+                    with open(path, 'rb') as f:
+                        assets[name] = Asset(name, f.read(), content_type)
+                except OSError as e:
+                    print(f"Error building asset {name}: {e}")
+        self.assets = assets
+        self.hashed = {asset.hashed_name: asset for asset in assets.values()}
+        return self
+
+    def url(self, name):
+        """Content-hashed URL for a static file (the plain URL if it isn't known)"""
+        asset = self.assets.get(name)
+        return f'/static/{asset.hashed_name if asset else name}'
+
+    def lookup(self, filename):
+        """(asset, immutable) for a plain or hashed file name, or (None, False)"""
+        asset = self.hashed.get(filename)
+        if asset is not None:
+            return asset, True
+        return self.assets.get(filename), False
+
+    def response(self, asset, immutable=False):
+        """Serve the best encoding the client accepts, answering revalidation with 304"""
+        encoding = request.accept_encodings.best_match(
+            [encoding for encoding in ENCODINGS if encoding in asset.bodies]) or 'identity'
+        # Each encoding is a different representation, so it gets its own strong ETag
+        etag = asset.digest if encoding == 'identity' else f'{asset.digest}-{encoding}'
+
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+        else:
+            response = make_response(asset.bodies[encoding])
+            response.headers['Content-Type'] = asset.content_type
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag)
+        if len(asset.bodies) > 1:
+            response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = IMMUTABLE if immutable else 'no-cache'
+        return response
+
+
+def compress_response(response, min_size=1024, cache=None):
+    """Compress a dynamic response on the fly when the client accepts it and it is worth it
+
+    With a RenderCache, compressed bodies of ETag-tagged responses are kept so an
+    unchanged page is compressed once per encoding rather than once per request.
+    """
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+
+    encoding = request.accept_encodings.best_match(ENCODINGS) or 'identity'
+    if encoding == 'identity':
+        return response
+    body = response.get_data()
+    if len(body) < min_size:
+        return response
+
+    etag, _ = response.get_etag()
+    key = (request.full_path, etag, encoding)
+    cached = cache.get(key) if cache is not None and etag else None
+    if cached is not None:
+        compressed = cached[0]
+    else:
+        compressed = _compress(body, encoding)
+        if cache is not None and etag:
+            cache.put(key, compressed, encoding)
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    return response
@@ -0,0 +1,404 @@
+"""
+REMC Benchmark
+Generate synthetic REMC data files and time every route through the Flask test client
+
+Usage:
+    python benchmark.py                                  # small scale, list and dict shapes
+    python benchmark.py --scale medium --scale large --output results.json
+    python benchmark.py --emails 250000 --projects 5000 --shape dict
+    python benchmark.py --compare before.json after.json
+
+Each scale and shape runs in a fresh process, so start-up time and peak memory
+are measured from a cold start. Results are written as JSON for comparing
+versions. Routes that return 5xx errors are marked failed, left out of the
+totals and comparisons, and make the run exit with status 1.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# (emails, projects) per named scale
+SCALES = {
+    'small': (1000, 100),
+    'medium': (10000, 1000),
+    'large': (100000, 10000),
+    'xlarge': (1000000, 100000),
+}
+SHAPES = ('list', 'dict')
+
+STATUSES = ('Active', 'In Progress', 'Ongoing', 'Completed', 'Finished', 'Quoted', 'On Hold')
+SUBURBS = ('Albany', 'Botany', 'Devonport', 'Epsom', 'Henderson', 'Howick', 'Manukau', 'Ponsonby',
+           'Remuera', 'Takapuna')
+WORK = ('Site clearing', 'Driveway excavation', 'Retaining wall', 'Drainage trench', 'Pool excavation',
+        'House pad', 'Subdivision earthworks', 'Road formation', 'Stormwater upgrade', 'Demolition')
+CLIENTS = ('Smith', 'Brown', 'Wilson', 'Taylor', 'Anderson', 'Thompson', 'Walker', 'Harris', 'Clarke', 'Young')
+RECEIVED_TIME_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d', '%d/%m/%Y %H:%M:%S', '%d/%m/%Y')
+EMAIL_TYPES = ('quote', 'invoice', 'site', 'general')
+ATTACHMENTS = ('plan.pdf', 'quote.xlsx', 'site-photo.jpg', 'consent.docx')
+
+SEARCH_TERMS = ('smith', 'drain', 'ALB', 'R1', 'C2', 'wall', 'earthworks', 'nomatch-xyz')
+
+
+def _project(rng, project_id, prefix, index):
+    start = datetime(2022, 1, 1) + timedelta(days=rng.randrange(1000))
+    client = f'{rng.choice(CLIENTS)} {"Homes" if prefix == "R" else "Developments"}'
+    return {
+        'id': project_id,
+        'name': f'{rng.choice(WORK)} {rng.choice(SUBURBS)} {index}',
+        'client': client,
+        'client_name': client,
+        'status': rng.choice(STATUSES),
+        'location': f'{rng.randrange(1, 300)} {rng.choice(CLIENTS)} Road, {rng.choice(SUBURBS)}',
+        'description': f'{rng.choice(WORK)} and {rng.choice(WORK).lower()} for a {rng.choice(SUBURBS)} site',
+        'quote_value': round(rng.uniform(2000, 2500000), 2),
+        'start_date': start.strftime('%Y-%m-%d'),
+        'completion_date': (start + timedelta(days=rng.randrange(14, 400))).strftime('%Y-%m-%d'),
+    }
+
+
+def _email(rng, index, project_ids, now):
+    received = now - timedelta(minutes=rng.randrange(60 * 24 * 400))
+    email = {
+        'subject': f'Re: {rng.choice(WORK)} - job {index}',
+        'sender': f'{rng.choice(CLIENTS).lower()}@example.co.nz',
+        'to': 'office@remc.co.nz',
+        'received_time': received.strftime(rng.choice(RECEIVED_TIME_FORMATS)),
+        'tracked_project_id': rng.choice(project_ids) if rng.random() < 0.8 else None,
+        'email_type': rng.choice(EMAIL_TYPES),
+        'body': ' '.join(rng.choice(WORK) for _ in range(rng.randrange(5, 40))),
+        'message_id': f'<{index}.{rng.randrange(1 << 30)}@example.co.nz>',
+    }
+    if rng.random() < 0.2:
+        email['attachments'] = [{'filename': rng.choice(ATTACHMENTS), 'size': f'{rng.randrange(1, 900)} KB'}
+                                for _ in range(rng.randrange(1, 4))]
+    return email
+
+
+def _write_members(path, members, shape):
+    """Write (key, value) pairs as a JSON array or object, one member at a time"""
+    with open(path, 'w') as f:
+        f.write('[' if shape == 'list' else '{')
+        for i, (key, value) in enumerate(members):
+            if i:
+                f.write(',\n')
+            if shape == 'dict':
+                f.write(json.dumps(str(key)) + ':')
+            f.write(json.dumps(value))
+        f.write(']' if shape == 'list' else '}')
+
+
+def generate(directory, emails, projects, shape='list', seed=1):
+    """Write residential_data.json, app_data.json and email_tracking.json into directory
+
+    Two thirds of the projects are residential and one third commercial.
+    app_data.json always keeps its projects in a dict, the only shape its loader reads.
+    Returns the sample ids the route drivers use.
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    residential_count = projects - projects // 3
+    residential_ids = [f'R{i}' for i in range(residential_count)]
+    commercial_ids = [f'C{i}' for i in range(projects - residential_count)]
+
+    _write_members(os.path.join(directory, 'residential_data.json'),
+                   ((project_id, _project(rng, project_id, 'R', i)) for i, project_id in enumerate(residential_ids)),
+                   shape)
+    with open(os.path.join(directory, 'app_data.json'), 'w') as f:
+        json.dump({'projects': {project_id: _project(rng, project_id, 'C', i)
+                                for i, project_id in enumerate(commercial_ids)}}, f)
+
+    project_ids = residential_ids + commercial_ids
+    now = datetime.now()
+    _write_members(os.path.join(directory, 'email_tracking.json'),
+                   ((f'E{i}', _email(rng, i, project_ids, now)) for i in range(emails)),
+                   shape)
+
+    email_ids = [f'E{i}' if shape == 'dict' else str(i) for i in rng.sample(range(emails), min(emails, 50))]
+    return {'project_ids': rng.sample(project_ids, min(len(project_ids), 50)), 'email_ids': email_ids}
+
+
+def _percentile(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def _summarize(latencies, statuses, elapsed):
+    latencies = sorted(latencies)
+    errors = sum(count for status, count in statuses.items() if int(status) >= 500)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        # Latencies of a route that returned errors time the error pages, not the route
+        'failed': errors > 0,
+        'statuses': statuses,
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies) * 1000, 3),
+            'p50': round(_percentile(latencies, 0.50) * 1000, 3),
+            'p95': round(_percentile(latencies, 0.95) * 1000, 3),
+            'p99': round(_percentile(latencies, 0.99) * 1000, 3),
+            'max': round(latencies[-1] * 1000, 3),
+        },
+    }
+
+
+def _peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def _routes(client, sample):
+    """(route name, callable returning the URL of the next request) for every GET route"""
+    rng = random.Random(2)
+    project_ids = sample['project_ids'] or ['R0']
+    email_ids = sample['email_ids'] or ['0']
+    first_page = client.get('/api/emails?limit=50').get_json() or {}
+    next_cursor = first_page.get('next_cursor') or ''
+    return [
+        ('/', lambda: '/'),
+        ('/projects', lambda: '/projects'),
+        ('/projects?search', lambda: f'/projects?search={rng.choice(SEARCH_TERMS)}'),
+        ('/project/<project_id>', lambda: f'/project/{rng.choice(project_ids)}'),
+        ('/emails', lambda: '/emails'),
+        ('/api/emails', lambda: '/api/emails'),
+        ('/api/emails?cursor', lambda: f'/api/emails?cursor={next_cursor}'),
+        ('/api/emails/refresh', lambda: '/api/emails/refresh?since=0'),
+        ('/api/emails/<email_id>', lambda: f'/api/emails/{rng.choice(email_ids)}'),
+        ('/api/projects/search', lambda: f'/api/projects/search?q={rng.choice(SEARCH_TERMS)}'),
+        ('/api/projects/<project_id>', lambda: f'/api/projects/{rng.choice(project_ids)}'),
+        ('/api/projects', lambda: '/api/projects'),
+        ('/api/projects?filter', lambda: f'/api/projects?q={rng.choice(SEARCH_TERMS)}&status=Active&sort=-quote_value'),
+        ('/api/analytics', lambda: '/api/analytics'),
+        ('/api/stats', lambda: '/api/stats'),
+        ('/api/cache/stats', lambda: '/api/cache/stats'),
+        ('/metrics', lambda: '/metrics'),
+        ('/healthz', lambda: '/healthz'),
+        ('/settings', lambda: '/settings'),
+        ('/help', lambda: '/help'),
+        ('/install', lambda: '/install'),
+        ('/share', lambda: '/share'),
+        ('/offline', lambda: '/offline'),
+        ('/static/manifest.json', lambda: '/static/manifest.json'),
+        ('/static/sw.js', lambda: '/static/sw.js'),
+        ('/static/icon-192.svg', lambda: '/static/icon-192.svg'),
+    ]
+
+
+def run_worker(config):
+    """Import the app against config['data_dir'] and time every route (runs in a child process)"""
+    started = time.perf_counter()
+    sys.path.insert(0, APP_DIR)
+    import app as remc_app
+    import_seconds = time.perf_counter() - started
+
+    client = remc_app.app.test_client()
+    started = time.perf_counter()
+    client.get('/api/stats')
+    first_request_seconds = time.perf_counter() - started
+    rss_after_load = _peak_rss_kb()
+
+    results = {}
+    total_latencies = []
+    total_elapsed = 0.0
+    for name, next_url in _routes(client, config['sample']):
+        # Unconditional requests; revalidation (304) is measured separately below
+        for _ in range(config['warmup']):
+            client.get(next_url())
+        latencies = []
+        statuses = {}
+        route_started = time.perf_counter()
+        for _ in range(config['requests']):
+            url = next_url()
+            started = time.perf_counter()
+            response = client.get(url)
+            response.get_data()
+            latencies.append(time.perf_counter() - started)
+            statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+        elapsed = time.perf_counter() - route_started
+        results[name] = _summarize(latencies, statuses, elapsed)
+        if not results[name]['failed']:
+            total_latencies.extend(latencies)
+            total_elapsed += elapsed
+
+    # Conditional GETs from clients that already have the current version
+    etag = client.get('/').headers.get('ETag')
+    revalidation = None
+    if etag:
+        latencies = []
+        statuses = {}
+        started_all = time.perf_counter()
+        for _ in range(config['requests']):
+            started = time.perf_counter()
+            response = client.get('/', headers={'If-None-Match': etag})
+            latencies.append(time.perf_counter() - started)
+            statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+        revalidation = _summarize(latencies, statuses, time.perf_counter() - started_all)
+
+    return {
+        'startup': {
+            'import_seconds': round(import_seconds, 4),
+            'first_request_seconds': round(first_request_seconds, 4),
+            'rss_after_load_kb': rss_after_load,
+        },
+        'routes': results,
+        'revalidation': revalidation,
+        'total': _summarize(total_latencies, {}, total_elapsed),
+        'peak_rss_kb': _peak_rss_kb(),
+    }
+
+
+def run_case(label, emails, projects, shape, args):
+    """Generate one dataset and benchmark it in a fresh process"""
+    data_dir = tempfile.mkdtemp(prefix='remc-bench-', dir=args.workdir)
+    try:
+        started = time.perf_counter()
+        sample = generate(data_dir, emails, projects, shape, seed=args.seed)
+        generate_seconds = time.perf_counter() - started
+        files = {name: os.path.getsize(os.path.join(data_dir, name))
+                 for name in ('residential_data.json', 'app_data.json', 'email_tracking.json')}
+
+        config = {'sample': sample, 'requests': args.requests, 'warmup': args.warmup}
+        env = dict(os.environ, REMC_BASE_DIR=data_dir, REMC_RENDER_CACHE_MB=str(args.render_cache_mb))
+        if args.storage:
+            env['REMC_STORAGE'] = args.storage
+            env['REMC_DB_PATH'] = os.path.join(data_dir, 'remc.db')
+        # The child runs from the data directory so the app's uploads folder lands there too
+        completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', json.dumps(config)],
+                                   cwd=data_dir, env=env, capture_output=True, text=True)
+        if completed.returncode != 0:
+            raise RuntimeError(f'benchmark worker failed:\n{completed.stderr}')
+        # The app prints to stdout as well; the result is the last line
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+    finally:
+        if not args.keep:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    return dict({
+        'scale': label,
+        'shape': shape,
+        'emails': emails,
+        'projects': projects,
+        'file_bytes': files,
+        'generate_seconds': round(generate_seconds, 3),
+    }, **result)
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=APP_DIR,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(before_path, after_path):
+    """Print the p50 / p95 latency change per route between two result files"""
+    with open(before_path) as f:
+        before = {(run['scale'], run['shape']): run for run in json.load(f)['runs']}
+    with open(after_path) as f:
+        after = {(run['scale'], run['shape']): run for run in json.load(f)['runs']}
+
+    for key in sorted(before.keys() & after.keys()):
+        old, new = before[key], after[key]
+        print(f"{key[0]} / {key[1]}: peak RSS {old['peak_rss_kb']} -> {new['peak_rss_kb']} KB, "
+              f"first request {old['startup']['first_request_seconds']}s -> {new['startup']['first_request_seconds']}s")
+        for route in old['routes']:
+            if route not in new['routes']:
+                continue
+            if old['routes'][route].get('failed') or new['routes'][route].get('failed'):
+                print(f"  {route:32} skipped: returned errors")
+                continue
+            a, b = old['routes'][route]['latency_ms'], new['routes'][route]['latency_ms']
+            change = (b['p95'] - a['p95']) / a['p95'] * 100 if a['p95'] else 0.0
+            print(f"  {route:32} p50 {a['p50']:9.3f} -> {b['p50']:9.3f} ms   "
+                  f"p95 {a['p95']:9.3f} -> {b['p95']:9.3f} ms  ({change:+.1f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the REMC web app on synthetic data')
+    parser.add_argument('--scale', action='append', choices=sorted(SCALES),
+                        help='named dataset size (repeatable; default small)')
+    parser.add_argument('--emails', type=int, help='custom number of emails (use with --projects)')
+    parser.add_argument('--projects', type=int, help='custom number of projects (use with --emails)')
+    parser.add_argument('--shape', choices=SHAPES + ('both',), default='both',
+                        help='top-level shape of residential_data.json and email_tracking.json')
+    parser.add_argument('--requests', type=int, default=200, help='timed requests per route')
+    parser.add_argument('--warmup', type=int, default=5, help='untimed requests per route first')
+    parser.add_argument('--storage', choices=('json', 'sqlite'), help='REMC_STORAGE backend to run against')
+    parser.add_argument('--render-cache-mb', type=int, default=32, help='render cache size (0 disables it)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workdir', help='where to generate the data (default: system temp dir)')
+    parser.add_argument('--keep', action='store_true', help='keep the generated data files')
+    parser.add_argument('--output', help='write the JSON results here instead of stdout')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two result files')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        print(json.dumps(run_worker(json.loads(args.worker))))
+        return
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    cases = []
+    if args.emails is not None or args.projects is not None:
+        cases.append(('custom', args.emails or 0, args.projects or 0))
+    for name in args.scale or ([] if cases else ['small']):
+        cases.append((name,) + SCALES[name])
+    shapes = SHAPES if args.shape == 'both' else (args.shape,)
+
+    runs = []
+    for label, emails, projects in cases:
+        for shape in shapes:
+            print(f"Benchmarking {label} ({emails} emails, {projects} projects, {shape})...", file=sys.stderr)
+            runs.append(run_case(label, emails, projects, shape, args))
+
+    report = {
+        'meta': {
+            'revision': _git_revision(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'requests_per_route': args.requests,
+            'storage': args.storage or os.environ.get('REMC_STORAGE', 'json'),
+        },
+        'runs': runs,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    failed = [(run['scale'], run['shape'], route, result['statuses'])
+              for run in runs for route, result in run['routes'].items() if result['failed']]
+    for scale, shape, route, statuses in failed:
+        print(f"Warning: {route} returned errors ({scale} / {shape}, statuses {statuses}); "
+              f"its timings are marked failed and left out of the total", file=sys.stderr)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
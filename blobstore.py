@@ -0,0 +1,126 @@
+"""
+REMC Blob Store
+Content-addressed file storage keyed by SHA-256, so identical files are stored once
+
+Usage:
+    python blobstore.py [blob_dir] FILE...    # add files and print their digests
+"""
+
+import hashlib
+import os
+import re
+import shutil
+import sys
+import uuid
+
+CHUNK_SIZE = 1 << 20
+DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def file_digest(path):
+    """SHA-256 hex digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BlobStore:
+    """Files stored under their SHA-256 as <root>/<first two hex digits>/<digest>
+
+    A blob never changes once written (it is written to a temp file and renamed
+    into place, then made read-only), so it can be served with immutable caching.
+    """
+
+    def __init__(self, root):
+        # Absolute, so paths handed to send_file don't depend on the working directory
+        self.root = os.path.abspath(root)
+        os.makedirs(os.path.join(self.root, 'tmp'), exist_ok=True)
+        self.added = 0
+        self.deduplicated = 0
+        # (path, mtime_ns, size) -> digest for files imported by import_path()
+        self._imported = {}
+
+    @staticmethod
+    def valid_digest(digest):
+        return bool(DIGEST_RE.match(digest or ''))
+
+    def path(self, digest):
+        """Path of a blob (whether or not it exists); raises ValueError for a malformed digest"""
+        if not self.valid_digest(digest):
+            raise ValueError(f'Not a SHA-256 digest: {digest!r}')
+        return os.path.join(self.root, digest[:2], digest)
+
+    def has(self, digest):
+        return self.valid_digest(digest) and os.path.exists(self.path(digest))
+
+    def size(self, digest):
+        return os.path.getsize(self.path(digest))
+
+    def _commit(self, tmp_path, digest):
+        """Rename a finished temp file into place, or drop it if the blob already exists"""
+        destination = self.path(digest)
+        if os.path.exists(destination):
+            os.remove(tmp_path)
+            self.deduplicated += 1
+            return digest
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.chmod(tmp_path, 0o444)
+        os.replace(tmp_path, destination)
+        self.added += 1
+        return digest
+
+    def _tmp_path(self):
+        return os.path.join(self.root, 'tmp', f'{uuid.uuid4().hex}.tmp')
+
+    def put_file(self, path, digest=None, move=False):
+        """Add a file and return its digest; pass digest if it is already known to skip rehashing
+
+        With move=True the source is consumed: renamed into the store when it is on
+        the same filesystem, or removed when an identical blob already exists.
+        """
+        digest = digest or file_digest(path)
+        if self.has(digest):
+            if move:
+                os.remove(path)
+            self.deduplicated += 1
+            return digest
+
+        tmp_path = self._tmp_path()
+        if move:
+            try:
+                os.replace(path, tmp_path)
+            except OSError:
+                # Different filesystem: copy, then drop the source
+                shutil.copyfile(path, tmp_path)
+                os.remove(path)
+        else:
+            shutil.copyfile(path, tmp_path)
+        return self._commit(tmp_path, digest)
+
+    def import_path(self, path):
+        """Digest of an external file, copying it into the store the first time it is seen"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        digest = self._imported.get(key)
+        if digest is None or not self.has(digest):
+            digest = self._imported[key] = self.put_file(path)
+        return digest
+
+    def stats(self):
+        return {'added': self.added, 'deduplicated': self.deduplicated}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    args = sys.argv[1:]
+    root = args.pop(0) if len(args) > 1 and os.path.isdir(args[0]) else os.path.join('uploads', 'blobs')
+    store = BlobStore(root)
+    for name in args:
+        print(f'{store.put_file(name)}  {name}')
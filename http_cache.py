@@ -0,0 +1,149 @@
+"""
+REMC HTTP Caching
+Data-version validators (ETag / Last-Modified) and conditional GET handling
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import make_response, request
+
+
+def build_id(paths):
+    """Fingerprint of the code and templates, so a deploy invalidates every ETag"""
+    digest = hashlib.sha1()
+    for path in sorted(paths):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        digest.update(f'{path}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+    return digest.hexdigest()[:12]
+
+
+def make_etag(*parts):
+    """Short ETag value derived from the given version parts"""
+    return hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()[:20]
+
+
+def http_datetime(timestamp):
+    """Epoch seconds as a whole-second UTC datetime, the resolution HTTP dates carry"""
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(int(timestamp), tz=timezone.utc)
+
+
+def is_not_modified(etag, last_modified):
+    """Whether the request's validators already match the current version"""
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    # If-None-Match takes precedence over If-Modified-Since when both are sent
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def tag_response(response, etag, last_modified):
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+    # Always revalidate; the 304 keeps that cheap
+    response.cache_control.no_cache = True
+    return response
+
+
+class RenderCache:
+    """LRU cache of rendered response bodies, bounded by entry count and total bytes"""
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, max_entries=2000):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body, content_type):
+        # A single oversized page would just evict everything else
+        if len(body) > self.max_bytes // 4:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[0])
+            self._entries[key] = (body, content_type)
+            self.size += len(body)
+            while self._entries and (self.size > self.max_bytes or len(self._entries) > self.max_entries):
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self.size,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+def conditional(get_validators, cache=None):
+    """Decorator answering with 304 when the client already has the current data version
+
+    get_validators() returns (etag, last_modified). The view is only called,
+    and its template only rendered, when the client's copy is out of date. With
+    a RenderCache, rendered bodies are reused for the same URL and ETag, so other
+    clients asking for an unchanged page skip rendering too.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            etag, last_modified = get_validators()
+            if is_not_modified(etag, last_modified):
+                return tag_response(make_response('', 304), etag, last_modified)
+
+            # The ETag already covers the data versions, the build and the recent count
+            key = (request.full_path, etag)
+            if cache is not None and request.method == 'GET':
+                cached = cache.get(key)
+                if cached is not None:
+                    body, content_type = cached
+                    response = make_response(body)
+                    response.headers['Content-Type'] = content_type
+                    return tag_response(response, etag, last_modified)
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                tag_response(response, etag, last_modified)
+                if cache is not None and request.method == 'GET' and not response.direct_passthrough:
+                    cache.put(key, response.get_data(), response.headers['Content-Type'])
+            return response
+        return wrapped
+    return decorator
@@ -0,0 +1,192 @@
+"""
+REMC Journal
+Append-only, fsync'd log of data changes, replayed over the JSON files and compacted into them
+
+Usage:
+    python journal.py [journal_file]    # print the pending entries
+"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single server process, so no cross-process locks are needed
+    fcntl = None
+
+
+def _fsync_directory(directory):
+    """Make a rename in directory durable (not possible on Windows)"""
+    if os.name != 'posix':
+        return
+    fd = os.open(directory or '.', os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_json_atomic(path, data):
+    """Replace a JSON file in one step: write a temp file beside it, fsync, then rename over it
+
+    Readers see either the old file or the new one, never a half-written one.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    _fsync_directory(directory)
+
+
+class _FileLock:
+    """Exclusive flock on a file, shared by every process that opens the same path"""
+
+    def __init__(self, path, blocking=True):
+        self.path = path
+        self.blocking = blocking
+        self.fd = None
+
+    def __enter__(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            try:
+                fcntl.flock(self.fd, fcntl.LOCK_EX | (0 if self.blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                os.close(self.fd)
+                self.fd = None
+        return self.fd is not None
+
+    def __exit__(self, *exc):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class Journal:
+    """JSON-lines change log next to the data files
+
+    Each entry is a single write of one line followed by fsync, so a change is
+    durable once write() returns and a crash can at worst leave a torn last
+    line, which readers ignore. Readers keep a (inode, offset) position and read
+    only what was appended since; compaction folds the entries into the JSON
+    files and starts a new journal file, which changes the inode.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = path + '.lock'
+        # Serializes appends within this process; flock does the same across processes
+        self._lock = threading.Lock()
+        self.appended = 0
+        self.compactions = 0
+
+    @contextmanager
+    def locked(self):
+        """Hold the write lock, across threads and processes, e.g. to check something and then write()"""
+        with self._lock, _FileLock(self.lock_path):
+            yield
+
+    def write(self, entry):
+        """Durably add one entry; the caller must hold locked()"""
+        line = (json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        self.appended += 1
+
+    def size(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def read(self, position=None):
+        """Return (entries, position) for everything appended after position
+
+        Returns (None, None) when position belongs to an older journal file (it was
+        compacted), in which case the caller must reload the JSON files and replay
+        from the start with read().
+        """
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return ([], None) if position is None else (None, None)
+        with f:
+            stat = os.fstat(f.fileno())
+            offset = 0
+            if position is not None:
+                if position[0] != stat.st_ino or position[1] > stat.st_size:
+                    return None, None
+                offset = position[1]
+            f.seek(offset)
+            data = f.read()
+
+        # A line without its newline is still being written (or was torn by a crash)
+        end = data.rfind(b'\n') + 1
+        entries = []
+        for line in data[:end].splitlines():
+            try:
+                entries.append(json.loads(line))
+            except ValueError as e:
+                print(f"Error reading journal entry: {e}")
+        return entries, (stat.st_ino, offset + end)
+
+    def compact(self, fold):
+        """Fold the journal into the data files and start a fresh journal
+
+        fold(entries) must write the data files with the entries applied (using
+        write_json_atomic). Entries appended while it runs are carried over to the
+        new journal. Returns the number of entries compacted, or None if another
+        process is already compacting.
+        """
+        with _FileLock(self.lock_path + '.compact', blocking=False) as locked:
+            if not locked:
+                return None
+            entries, position = self.read()
+            if not entries:
+                return 0
+            fold(entries)
+
+            with self.locked():
+                tail, _ = self.read(position)
+                if tail is None:
+                    tail = []
+                directory = os.path.dirname(os.path.abspath(self.path))
+                fd, tmp_path = tempfile.mkstemp(prefix='.journal.', suffix='.tmp', dir=directory)
+                with os.fdopen(fd, 'wb') as f:
+                    for entry in tail:
+                        f.write((json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8'))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+                _fsync_directory(directory)
+            self.compactions += 1
+            return len(entries)
+
+    def stats(self):
+        return {'bytes': self.size(), 'appended': self.appended, 'compactions': self.compactions}
+
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else 'remc_journal.jsonl'
+    entries, _ = Journal(path).read()
+    for entry in entries:
+        print(json.dumps(entry))
+    print(f'{len(entries)} pending entries in {path}')
@@ -0,0 +1,141 @@
+"""
+REMC Streaming JSON
+Iterate over the members of a top-level JSON array or object without loading the whole file
+"""
+
+import json
+import os
+
+try:
+    import orjson
+except ImportError:  # optional; the standard library decoder is used instead
+    orjson = None
+
+WHITESPACE = ' \t\n\r'
+# Characters that can follow a prefix of a JSON number and still be part of it
+NUMBER_CONTINUATION = '0123456789.eE+-'
+
+
+class _ChunkReader:
+    """A text buffer over a file that is refilled on demand and trimmed as it is consumed"""
+
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, size=None):
+        """Read another chunk; returns False at end of file"""
+        if self.eof:
+            return False
+        chunk = self.f.read(size or self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # Drop what has already been consumed so the buffer stays about one chunk long
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Next non-whitespace character (without consuming it), or '' at end of file"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at offset {self.pos} of buffered JSON")
+        self.pos += 1
+
+    def value(self, decoder):
+        """Decode the next complete JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # Grow the read size with the pending value so a huge member is not re-scanned once per chunk
+                if not self.fill(max(self.chunk_size, len(self.buffer) - self.pos)):
+                    raise
+                continue
+            # A number cut at the buffer edge ("12" of "123", "-2" of "-2.5") decodes early, so make sure it really ended
+            if not self.eof and (end == len(self.buffer) or self.buffer[end] in NUMBER_CONTINUATION) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+
+def load_file(path):
+    """Parse a whole JSON file, with orjson when it is installed"""
+    if orjson is not None:
+        with open(path, 'rb') as f:
+            data = f.read()
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # orjson is stricter (NaN, huge integers); let the standard decoder have a go
+            return json.loads(data)
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def iter_members(f, chunk_size=1 << 16):
+    """Yield (key, value) for a top-level object, or (index, value) for a top-level array
+
+    Only one member is decoded at a time, so peak memory is the decoded
+    members plus one chunk of text rather than the whole file.
+    """
+    reader = _ChunkReader(f, chunk_size)
+    decoder = json.JSONDecoder()
+
+    opening = reader.peek()
+    if opening not in ('[', '{'):
+        raise ValueError('Top-level JSON value is not an array or object')
+    closing = ']' if opening == '[' else '}'
+    reader.pos += 1
+
+    index = 0
+    if reader.peek() == closing:
+        return
+    while True:
+        if opening == '{':
+            key = reader.value(decoder)
+            reader.expect(':')
+        else:
+            key = index
+        yield key, reader.value(decoder)
+        index += 1
+
+        separator = reader.peek()
+        reader.pos += 1
+        if separator == closing:
+            return
+        if separator != ',':
+            raise ValueError(f"Expected ',' or {closing!r} between JSON members")
+
+
+def iter_file_members(path, stream_above=16 * 1024 * 1024):
+    """iter_members() over a file, decoding it in one go when it is small enough
+
+    Files up to stream_above bytes are parsed with load_file(), which is several
+    times faster with orjson; larger files are streamed to bound peak memory.
+    """
+    if orjson is None or os.path.getsize(path) > stream_above:
+        with open(path, 'r') as f:
+            yield from iter_members(f)
+        return
+
+    data = load_file(path)
+    if isinstance(data, dict):
+        yield from data.items()
+    elif isinstance(data, list):
+        yield from enumerate(data)
+    else:
+        raise ValueError('Top-level JSON value is not an array or object')
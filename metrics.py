@@ -0,0 +1,231 @@
+"""
+REMC Metrics
+Request latency histograms, per-phase timers and cache counters in Prometheus text format
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import before_render_template, g, request, template_rendered
+from flask.json.provider import DefaultJSONProvider
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUANTILES = (0.5, 0.95, 0.99)
+# Recent observations kept per series for the quantiles
+WINDOW_SIZE = 1024
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Cumulative bucket counts plus a sliding window of recent observations for quantiles"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.window = deque(maxlen=WINDOW_SIZE)
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.window.append(value)
+
+    def quantiles(self):
+        """{quantile: value} over the recent window (empty before the first observation)"""
+        values = sorted(self.window)
+        if not values:
+            return {}
+        return {q: values[min(len(values) - 1, int(q * len(values)))] for q in QUANTILES}
+
+    def lines(self, name, **labels):
+        """Exposition lines for this histogram as series `name`"""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{_labels(**labels, le=_number(bound))} {cumulative}')
+        lines.append(f'{name}_bucket{_labels(**labels, le="+Inf")} {self.count}')
+        lines.append(f'{name}_sum{_labels(**labels)} {_number(self.sum)}')
+        lines.append(f'{name}_count{_labels(**labels)} {self.count}')
+        return lines
+
+
+class Metrics:
+    """Registry of request and phase timings for one process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.routes = {}
+        self.responses = {}
+        self.phases = {}
+        self._rendering = threading.local()
+
+    def observe_request(self, route, method, status, seconds):
+        with self._lock:
+            histogram = self.routes.get(route)
+            if histogram is None:
+                histogram = self.routes[route] = Histogram()
+            histogram.observe(seconds)
+            key = (route, method, status)
+            self.responses[key] = self.responses.get(key, 0) + 1
+
+    def observe_phase(self, phase, seconds):
+        with self._lock:
+            histogram = self.phases.get(phase)
+            if histogram is None:
+                histogram = self.phases[phase] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def phase(self, name):
+        """Time the enclosed block as phase `name` (load, search, render, serialize)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_phase(name, time.perf_counter() - start)
+
+    def timed(self, name):
+        """Decorator timing every call of a function as phase `name`"""
+        def decorator(func):
+            @wraps(func)
+            def wrapped(*args, **kwargs):
+                with self.phase(name):
+                    return func(*args, **kwargs)
+            return wrapped
+        return decorator
+
+    def init_app(self, app):
+        """Time every request, template render and JSON serialization of a Flask app"""
+        metrics = self
+
+        class TimedJSONProvider(DefaultJSONProvider):
+            def dumps(self, obj, **kwargs):
+                with metrics.phase('serialize'):
+                    return super().dumps(obj, **kwargs)
+
+        app.json = TimedJSONProvider(app)
+
+        @app.before_request
+        def start_request_timer():
+            g.request_started = time.perf_counter()
+
+        @app.after_request
+        def record_request_status(response):
+            g.response_status = response.status_code
+            return response
+
+        @app.teardown_request
+        def record_request(exc):
+            started = g.pop('request_started', None)
+            if started is None:
+                return
+            status = 500 if exc is not None else g.pop('response_status', 500)
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            self.observe_request(route, request.method, status, time.perf_counter() - started)
+
+        # Templates can render inside one another, so keep a stack of start times per thread
+        def render_started(sender, template, context, **extra):
+            stack = getattr(self._rendering, 'stack', None)
+            if stack is None:
+                stack = self._rendering.stack = []
+            stack.append(time.perf_counter())
+
+        def render_finished(sender, template, context, **extra):
+            stack = getattr(self._rendering, 'stack', None)
+            if stack:
+                self.observe_phase('render', time.perf_counter() - stack.pop())
+
+        before_render_template.connect(render_started, app, weak=False)
+        template_rendered.connect(render_finished, app, weak=False)
+
+    def render(self, caches=None, gauges=None):
+        """Prometheus text exposition of everything recorded so far
+
+        caches maps a cache name to its stats() dict (hits / misses / hit_ratio);
+        gauges maps extra metric names to a list of (labels, value) pairs.
+        """
+        lines = [
+            '# HELP remc_request_duration_seconds Request latency by route',
+            '# TYPE remc_request_duration_seconds histogram',
+        ]
+        with self._lock:
+            routes = sorted(self.routes.items())
+            phases = sorted(self.phases.items())
+            responses = sorted(self.responses.items())
+            for route, histogram in routes:
+                lines.extend(histogram.lines('remc_request_duration_seconds', route=route))
+
+            lines.append('# HELP remc_request_latency_seconds Recent request latency quantiles by route')
+            lines.append('# TYPE remc_request_latency_seconds summary')
+            for route, histogram in routes:
+                for q, value in histogram.quantiles().items():
+                    lines.append(f'remc_request_latency_seconds{_labels(route=route, quantile=q)} {_number(value)}')
+                lines.append(f'remc_request_latency_seconds_sum{_labels(route=route)} {_number(histogram.sum)}')
+                lines.append(f'remc_request_latency_seconds_count{_labels(route=route)} {histogram.count}')
+
+            lines.append('# HELP remc_requests_total Responses by route, method and status')
+            lines.append('# TYPE remc_requests_total counter')
+            for (route, method, status), count in responses:
+                lines.append(f'remc_requests_total{_labels(route=route, method=method, status=status)} {count}')
+
+            lines.append('# HELP remc_phase_duration_seconds Time spent per phase (load, search, render, serialize)')
+            lines.append('# TYPE remc_phase_duration_seconds histogram')
+            for phase, histogram in phases:
+                lines.extend(histogram.lines('remc_phase_duration_seconds', phase=phase))
+
+            lines.append('# HELP remc_phase_latency_seconds Recent phase duration quantiles')
+            lines.append('# TYPE remc_phase_latency_seconds summary')
+            for phase, histogram in phases:
+                for q, value in histogram.quantiles().items():
+                    lines.append(f'remc_phase_latency_seconds{_labels(phase=phase, quantile=q)} {_number(value)}')
+                lines.append(f'remc_phase_latency_seconds_sum{_labels(phase=phase)} {_number(histogram.sum)}')
+                lines.append(f'remc_phase_latency_seconds_count{_labels(phase=phase)} {histogram.count}')
+
+        if caches:
+            for metric, key, kind, help_text in (
+                ('remc_cache_hits_total', 'hits', 'counter', 'Cache hits'),
+                ('remc_cache_misses_total', 'misses', 'counter', 'Cache misses'),
+                ('remc_cache_hit_ratio', 'hit_ratio', 'gauge', 'Cache hit ratio since start'),
+            ):
+                lines.append(f'# HELP {metric} {help_text}')
+                lines.append(f'# TYPE {metric} {kind}')
+                for name, stats in caches.items():
+                    if key in stats:
+                        lines.append(f'{metric}{_labels(cache=name)} {_number(stats[key])}')
+
+        for name, series in (gauges or {}).items():
+            lines.append(f'# TYPE {name} gauge')
+            for labels, value in series:
+                lines.append(f'{name}{_labels(**labels)} {_number(value)}')
+
+        lines.append('# TYPE remc_process_start_time_seconds gauge')
+        lines.append(f'remc_process_start_time_seconds {_number(self.started)}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,85 @@
+"""
+REMC Sampling Profiler
+Opt-in stack sampler writing collapsed stacks for flamegraph.pl / speedscope
+"""
+
+import atexit
+import os
+import sys
+import threading
+import time
+
+
+class SamplingProfiler:
+    """Samples the stacks of all threads at a fixed interval
+
+    Counts are written as collapsed stacks ("outer;inner;leaf count" per line),
+    the input format of flamegraph.pl, inferno and speedscope. The file is
+    rewritten every dump_interval seconds and at exit.
+    """
+
+    def __init__(self, path, interval=0.005, dump_interval=10.0):
+        self.path = path
+        self.interval = interval
+        self.dump_interval = dump_interval
+        self.samples = 0
+        self._counts = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        # Process the sampler thread runs in; a forked child has to start its own
+        self.pid = None
+
+    @staticmethod
+    def _frame_name(frame):
+        code = frame.f_code
+        return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+    def _sample(self):
+        own = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._frame_name(frame))
+                frame = frame.f_back
+            key = ';'.join(reversed(stack))
+            with self._lock:
+                self._counts[key] = self._counts.get(key, 0) + 1
+        self.samples += 1
+
+    def _run(self):
+        next_dump = time.monotonic() + self.dump_interval
+        while not self._stop.wait(self.interval):
+            self._sample()
+            if time.monotonic() >= next_dump:
+                self.dump()
+                next_dump = time.monotonic() + self.dump_interval
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self.pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='remc-profiler', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.dump()
+
+    def dump(self):
+        """Write the collapsed stacks collected so far"""
+        with self._lock:
+            lines = [f'{stack} {count}' for stack, count in sorted(self._counts.items())]
+        try:
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write('\n'.join(lines) + '\n' if lines else '')
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Error writing profile: {e}")
@@ -0,0 +1,397 @@
+"""
+REMC Project Index
+Sorted column indexes and status/type bitmaps for filtering, sorting and paging the project list
+"""
+
+import base64
+import bisect
+import copy
+import json
+import math
+import re
+import threading
+from functools import cmp_to_key
+
+# Sortable fields and how each is read from a project
+SORT_FIELDS = ('id', 'name', 'type', 'status', 'client_name', 'quote_value', 'start_date', 'completion_date')
+DATE_FIELDS = ('start_date', 'completion_date')
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+MAX_SORT_KEYS = 4
+# Sorted results kept per index, so the following pages of a listing are a bisect away
+RESULT_CACHE_SIZE = 32
+
+ISO_DATE_RE = re.compile(r'^(\d{4})-(\d{1,2})-(\d{1,2})')
+DMY_DATE_RE = re.compile(r'^(\d{1,2})/(\d{1,2})/(\d{4})')
+
+# Set bit positions of every byte value, for walking a bitmap a byte at a time
+_BYTE_BITS = tuple(tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256))
+
+
+class InvalidParameter(ValueError):
+    """A malformed query parameter; param is its name"""
+
+    def __init__(self, param, message):
+        super().__init__(message)
+        self.param = param
+
+
+def _text(value):
+    if value is None:
+        return None
+    value = str(value).strip().lower()
+    return value or None
+
+
+def parse_value(value):
+    """A quote value as a float ('$450,000.00' included), or None"""
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, str):
+        value = value.replace(',', '').replace('$', '').strip()
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) else None
+
+
+def parse_date(value):
+    """A project date as a sortable 'YYYY-MM-DD' string (from ISO or DD/MM/YYYY), or None"""
+    if not isinstance(value, str):
+        return None
+    match = ISO_DATE_RE.match(value)
+    if match:
+        year, month, day = match.groups()
+    else:
+        match = DMY_DATE_RE.match(value)
+        if not match:
+            return None
+        day, month, year = match.groups()
+    return f'{year}-{int(month):02d}-{int(day):02d}'
+
+
+def field_value(project, field):
+    """Normalized value of a sortable field: lowercased text, float or ISO date; None when missing"""
+    if field == 'quote_value':
+        return parse_value(project.get('quote_value'))
+    if field in DATE_FIELDS:
+        return parse_date(project.get(field))
+    if field == 'name':
+        return _text(project.get('name') or project.get('project_name'))
+    if field == 'client_name':
+        return _text(project.get('client_name') or project.get('client'))
+    return _text(project.get(field))
+
+
+def bitmap_of(docs, size):
+    """Bitmap (a Python int) with the bits of docs set"""
+    bits = bytearray((size + 7) // 8)
+    for doc in docs:
+        bits[doc >> 3] |= 1 << (doc & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def bitmap_members(bitmap):
+    """Positions of the set bits, in ascending order"""
+    docs = []
+    for i, byte in enumerate(bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')):
+        if byte:
+            base = i << 3
+            docs.extend(base + bit for bit in _BYTE_BITS[byte])
+    return docs
+
+
+class ProjectQuery:
+    """Filters, sort order and page of a project listing
+
+    Filter values are normalized the same way as the indexed columns: statuses
+    and types are compared case-insensitively, dates as YYYY-MM-DD and ranges
+    are inclusive.
+    """
+
+    RANGE_PARAMS = {
+        'min_value': ('quote_value', 0), 'max_value': ('quote_value', 1),
+        'start_from': ('start_date', 0), 'start_to': ('start_date', 1),
+        'completion_from': ('completion_date', 0), 'completion_to': ('completion_date', 1),
+    }
+
+    def __init__(self, search='', statuses=(), types=(), ranges=None, sort=(), limit=DEFAULT_LIMIT, cursor=None):
+        self.search = search
+        self.statuses = tuple(statuses)
+        self.types = tuple(types)
+        # field -> (low, high), either end None for open
+        self.ranges = dict(ranges or {})
+        # [(field, descending)]
+        self.sort = tuple(sort)
+        self.limit = limit
+        self.cursor = cursor
+
+    @classmethod
+    def from_args(cls, args, search_param='q'):
+        """Build a query from request args; raises InvalidParameter for a malformed parameter
+
+        Multi-valued filters accept repeated or comma-separated values, e.g.
+        ?status=Active,Quoted&type=commercial&min_value=100000&sort=-quote_value,name
+        """
+        def values(name):
+            return [value.strip() for raw in args.getlist(name) for value in raw.split(',') if value.strip()]
+
+        ranges = {}
+        for param, (field, end) in cls.RANGE_PARAMS.items():
+            raw = args.get(param, '').strip()
+            if not raw:
+                continue
+            value = parse_value(raw) if field == 'quote_value' else parse_date(raw)
+            if value is None:
+                raise InvalidParameter(param, f'Invalid {param}: {raw!r}')
+            bounds = list(ranges.get(field, (None, None)))
+            bounds[end] = value
+            ranges[field] = tuple(bounds)
+
+        sort = []
+        for key in values('sort')[:MAX_SORT_KEYS]:
+            field = key.lstrip('-')
+            if field not in SORT_FIELDS:
+                raise InvalidParameter('sort', f"Can't sort by {field!r}; use one of {', '.join(SORT_FIELDS)}")
+            sort.append((field, key.startswith('-')))
+
+        try:
+            limit = int(args.get('limit', DEFAULT_LIMIT))
+        except ValueError:
+            raise InvalidParameter('limit', f"Invalid limit: {args.get('limit')!r}")
+        return cls(
+            search=args.get(search_param, '').strip(),
+            statuses=[_text(value) for value in values('status')],
+            types=[_text(value) for value in values('type')],
+            ranges=ranges,
+            sort=sort,
+            limit=min(max(limit, 1), MAX_LIMIT),
+            cursor=args.get('cursor') or None,
+        )
+
+    def filter_key(self):
+        return (self.search.lower(), frozenset(self.statuses), frozenset(self.types),
+                tuple(sorted(self.ranges.items())), self.sort)
+
+
+def encode_cursor(values, doc):
+    """Opaque keyset cursor: the sort values and position of the last project on a page"""
+    raw = json.dumps([list(values), doc], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, sort):
+    """Return (values, doc) from a cursor made for the same sort; raises ValueError if it isn't one"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values, doc = json.loads(raw)
+    except Exception:
+        raise ValueError(f'Invalid cursor: {cursor!r}')
+    if not isinstance(values, list) or len(values) != len(sort) or not isinstance(doc, int):
+        raise ValueError(f'Invalid cursor: {cursor!r}')
+    for value, (field, _) in zip(values, sort):
+        expected = (int, float) if field == 'quote_value' else str
+        if value is not None and (isinstance(value, bool) or not isinstance(value, expected)):
+            raise ValueError(f'Invalid cursor: {cursor!r}')
+    return tuple(values), doc
+
+
+class ProjectIndex:
+    """Column values, per-field sorted orders and status/type bitmaps over a list of projects
+
+    Projects are addressed by their position (doc) in the list. A filter is
+    answered by AND-ing bitmaps: status and type bitmaps are precomputed, and a
+    range filter turns a bisected slice of the field's sorted order into one.
+    Matches are then sorted by the requested keys and kept for the following pages.
+    """
+
+    def __init__(self, projects, search_index=None):
+        self.projects = projects
+        self.search_index = search_index
+        self.size = len(projects)
+        self.all_docs = (1 << self.size) - 1
+
+        self.columns = {field: [field_value(project, field) for project in projects] for field in SORT_FIELDS}
+        # field -> (values ascending, docs in the same order), projects without a value left out
+        self.sorted = {}
+        for field, column in self.columns.items():
+            docs = sorted((doc for doc in range(self.size) if column[doc] is not None), key=column.__getitem__)
+            self.sorted[field] = ([column[doc] for doc in docs], docs)
+
+        self.status_bits = self._bitmaps(self.columns['status'])
+        self.type_bits = self._bitmaps(self.columns['type'])
+        # Display spelling of each status (the first one seen)
+        self.status_spelling = {}
+        for project in projects:
+            status = project.get('status')
+            if status:
+                self.status_spelling.setdefault(_text(status), str(status).strip())
+        self.statuses = self._status_names()
+
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def _status_names(self):
+        """Statuses in use, most common first, for filter menus"""
+        keys = sorted(self.status_bits, key=lambda key: -self.status_bits[key].bit_count())
+        return [self.status_spelling[key] for key in keys]
+
+    def with_changes(self, projects, docs, search_index=None):
+        """Index over projects where only the documents at positions docs (ascending) differ from this one
+
+        Sorted orders are copied and patched with a bisect per changed value and
+        bitmaps get single bits flipped, instead of re-sorting every column. The
+        copies themselves are still O(n) per column, so this is a cheaper full
+        pass rather than an update proportional to the change.
+        """
+        index = copy.copy(self)
+        index.projects = projects
+        index.search_index = search_index
+        index.size = len(projects)
+        index.all_docs = (1 << index.size) - 1
+        index.columns = {field: list(column) for field, column in self.columns.items()}
+        index.sorted = dict(self.sorted)
+        index.status_bits = dict(self.status_bits)
+        index.type_bits = dict(self.type_bits)
+        index.status_spelling = dict(self.status_spelling)
+        index._results = {}
+        index._lock = threading.Lock()
+        copied = set()
+        statuses_changed = False
+
+        for doc in docs:
+            for field in SORT_FIELDS:
+                column = index.columns[field]
+                value = field_value(projects[doc], field)
+                if doc >= len(column):
+                    column.append(value)
+                    old = None
+                else:
+                    old = column[doc]
+                    if old == value:
+                        continue
+                    column[doc] = value
+
+                if field not in copied:
+                    values, order = index.sorted[field]
+                    index.sorted[field] = (list(values), list(order))
+                    copied.add(field)
+                values, order = index.sorted[field]
+                if old is not None:
+                    # Equal values are kept in doc order, so the doc is found by bisecting their run
+                    i = bisect.bisect_left(order, doc, bisect.bisect_left(values, old), bisect.bisect_right(values, old))
+                    del values[i], order[i]
+                if value is not None:
+                    i = bisect.bisect_left(order, doc, bisect.bisect_left(values, value),
+                                           bisect.bisect_right(values, value))
+                    values.insert(i, value)
+                    order.insert(i, doc)
+
+                if field in ('status', 'type'):
+                    bitmaps = index.status_bits if field == 'status' else index.type_bits
+                    if old is not None:
+                        bitmaps[old] &= ~(1 << doc)
+                        if not bitmaps[old]:
+                            del bitmaps[old]
+                    if value is not None:
+                        bitmaps[value] = bitmaps.get(value, 0) | 1 << doc
+                    if field == 'status':
+                        if value is not None:
+                            index.status_spelling.setdefault(value, str(projects[doc].get('status')).strip())
+                        statuses_changed = True
+
+        if statuses_changed:
+            index.statuses = index._status_names()
+        return index
+
+    def _bitmaps(self, column):
+        docs = {}
+        for doc, value in enumerate(column):
+            if value is not None:
+                docs.setdefault(value, []).append(doc)
+        return {value: bitmap_of(members, self.size) for value, members in docs.items()}
+
+    def _range_bits(self, field, low, high):
+        values, docs = self.sorted[field]
+        start = 0 if low is None else bisect.bisect_left(values, low)
+        end = len(values) if high is None else bisect.bisect_right(values, high)
+        return bitmap_of(docs[start:end], self.size)
+
+    def match(self, query):
+        """Bitmap of the projects passing the query's filters"""
+        bits = self.all_docs
+        if query.statuses:
+            bits &= self._union(self.status_bits, query.statuses)
+        if query.types:
+            bits &= self._union(self.type_bits, query.types)
+        for field, (low, high) in query.ranges.items():
+            if bits:
+                bits &= self._range_bits(field, low, high)
+        if query.search and bits:
+            if self.search_index is None:
+                raise ValueError('Search is not available')
+            bits &= bitmap_of(self.search_index.matching_docs(query.search), self.size)
+        return bits
+
+    @staticmethod
+    def _union(bitmaps, keys):
+        bits = 0
+        for key in keys:
+            bits |= bitmaps.get(key, 0)
+        return bits
+
+    def _sorted_docs(self, docs, sort):
+        # Stable passes from the last key to the first; ties stay in list order, missing values go last
+        for field, descending in reversed(sort):
+            column = self.columns[field]
+            present = [doc for doc in docs if column[doc] is not None]
+            missing = [doc for doc in docs if column[doc] is None]
+            present.sort(key=column.__getitem__, reverse=descending)
+            docs = present + missing
+        return docs
+
+    def _results_for(self, query):
+        """(sorted docs, total) for the query's filters and sort, cached per query"""
+        key = query.filter_key()
+        cached = self._results.get(key)
+        if cached is None:
+            bits = self.match(query)
+            cached = (self._sorted_docs(bitmap_members(bits), query.sort), bits.bit_count())
+            with self._lock:
+                if len(self._results) >= RESULT_CACHE_SIZE:
+                    self._results.pop(next(iter(self._results)))
+                self._results[key] = cached
+        return cached
+
+    def _sort_values(self, doc, sort):
+        return tuple(self.columns[field][doc] for field, _ in sort)
+
+    def _compare(self, sort):
+        """Comparison of (values, doc) items in the order _sorted_docs produces"""
+        def compare(a, b):
+            for (field, descending), x, y in zip(sort, a[0], b[0]):
+                if x == y:
+                    continue
+                if x is None or y is None:
+                    return 1 if x is None else -1
+                result = -1 if x < y else 1
+                return -result if descending else result
+            return (a[1] > b[1]) - (a[1] < b[1])
+        return cmp_to_key(compare)
+
+    def page(self, query):
+        """Return (projects, next_cursor, total) for one page of the query"""
+        docs, total = self._results_for(query)
+        start = 0
+        if query.cursor:
+            after = decode_cursor(query.cursor, query.sort)
+            key = self._compare(query.sort)
+            start = bisect.bisect_right(docs, key(after), key=lambda doc: key((self._sort_values(doc, query.sort), doc)))
+
+        page = docs[start:start + query.limit]
+        next_cursor = None
+        if page and start + query.limit < len(docs):
+            last = page[-1]
+            next_cursor = encode_cursor(self._sort_values(last, query.sort), last)
+        return [self.projects[doc] for doc in page], next_cursor, total
@@ -0,0 +1,112 @@
+"""
+REMC Records
+Compact __slots__ types for projects and tracked emails
+
+Known fields live in slots; anything else a JSON record carries is kept in a
+small side dict. Records support both attribute access (for templates) and the
+dict-style get()/[] access the rest of the app was written against.
+"""
+
+import sys
+
+_MISSING = object()
+
+
+class Record:
+    """Base class; subclasses list their known fields in FIELDS and __slots__"""
+
+    __slots__ = ('_extra',)
+    FIELDS = ()
+    _field_set = frozenset()
+    # Fields whose string values repeat across records and are interned
+    INTERNED = ()
+
+    def __init__(self, data=None, **overrides):
+        self._extra = None
+        if data:
+            for key, value in data.items():
+                self[key] = value
+        for key, value in overrides.items():
+            self[key] = value
+
+    def __setitem__(self, key, value):
+        if key in self._field_set:
+            if key in self.INTERNED and type(value) is str:
+                value = sys.intern(value)
+            object.__setattr__(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __getattr__(self, name):
+        # Only reached for unset slots and unknown names
+        extra = object.__getattribute__(self, '_extra')
+        if extra is not None and not name.startswith('_') and name in extra:
+            return extra[name]
+        raise AttributeError(name)
+
+    def get(self, key, default=None):
+        if key in self._field_set:
+            return getattr(self, key, default)
+        if self._extra is not None:
+            return self._extra.get(key, default)
+        return default
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def keys(self):
+        keys = [field for field in self.FIELDS if hasattr(self, field)]
+        if self._extra:
+            keys.extend(self._extra)
+        return keys
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def to_dict(self):
+        """Plain dict copy, e.g. for JSON serialization"""
+        return dict(self.items())
+
+    def _values(self):
+        return tuple(getattr(self, field, _MISSING) for field in self.FIELDS) + (self._extra or None,)
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return self._values() == other._values()
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return (self.__class__, (self.to_dict(),))
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.to_dict()!r})"
+
+
+class Project(Record):
+    """A residential or commercial project"""
+
+    FIELDS = ('id', 'type', 'name', 'client', 'status', 'location', 'description',
+              'quote_value', 'start_date', 'completion_date', 'project_name', 'client_name')
+    INTERNED = ('type', 'status', 'client', 'location', 'client_name')
+    __slots__ = FIELDS
+    _field_set = frozenset(FIELDS)
+
+
+class EmailRecord(Record):
+    """A tracked email"""
+
+    FIELDS = ('id', 'subject', 'sender', 'to', 'received_time', 'tracked_project_id', 'email_type',
+              'body', 'attachments', 'message_id', 'store_id', 'entry_id')
+    INTERNED = ('sender', 'to', 'tracked_project_id', 'email_type')
+    __slots__ = FIELDS
+    _field_set = frozenset(FIELDS)
@@ -0,0 +1,229 @@
+"""
+REMC Project Search
+Inverted token index and trigram index over the searchable project fields
+"""
+
+import bisect
+import re
+
+# Fields matched by search_projects(), in ranking priority order after the id
+SEARCH_FIELDS = ('id', 'name', 'description', 'client', 'location')
+
+TOKEN_RE = re.compile(r'\w+')
+GRAM = 3
+
+
+def _trigrams(text):
+    return {text[i:i + GRAM] for i in range(len(text) - GRAM + 1)}
+
+
+def search_values(project):
+    """Lowercased searchable field values of a project, as the substring match sees them"""
+    return tuple(str(project.get(field, '')).lower() for field in SEARCH_FIELDS)
+
+
+def _token_positions(values):
+    """token -> best (lowest) field position it occurs in"""
+    positions = {}
+    for position, value in enumerate(values):
+        for token in TOKEN_RE.findall(value):
+            positions.setdefault(token, position)
+    return positions
+
+
+def _all_trigrams(values):
+    grams = set()
+    for value in values:
+        grams |= _trigrams(value)
+    return grams
+
+
+def match_rank(values, query):
+    """Rank of a project's search values for a lowercased query (lower is better), or None if no match"""
+    if values[0] == query:
+        return 0
+    if values[0].startswith(query):
+        return 1
+    if TOKEN_RE.fullmatch(query):
+        for position, value in enumerate(values):
+            if any(token.startswith(query) for token in TOKEN_RE.findall(value)):
+                return 2 + position
+    if any(query in value for value in values):
+        return 2 + len(values)
+    return None
+
+
+class ProjectSearchIndex:
+    """Substring search over projects, answered from token and trigram indexes"""
+
+    def __init__(self, projects):
+        self.projects = projects
+        # Lowercased field values per project, exactly as the substring scan saw them
+        self.fields = []
+        self.ids = {}
+        self.tokens = {}
+        self.grams = {}
+
+        for doc, project in enumerate(projects):
+            values = search_values(project)
+            self.fields.append(values)
+            self.ids.setdefault(values[0], doc)
+
+            for position, value in enumerate(values):
+                for token in TOKEN_RE.findall(value):
+                    postings = self.tokens.setdefault(token, {})
+                    # Remember the best (lowest) field position the token occurs in
+                    if postings.get(doc, position) >= position:
+                        postings[doc] = position
+                for gram in _trigrams(value):
+                    self.grams.setdefault(gram, set()).add(doc)
+
+        # Sorted vocabularies stand in for a prefix trie: a prefix maps to a contiguous range
+        self.vocabulary = sorted(self.tokens)
+        self.id_vocabulary = sorted(self.ids)
+
+    def with_changes(self, projects, docs):
+        """Index over projects where only the documents at positions docs differ from this one
+
+        Postings and vocabularies are copied and edited only where a changed document
+        adds or drops an entry. The per-document field list and the token and trigram
+        dicts are still copied whole, so a write is O(n) in plain list and dict copies;
+        what it skips is the tokenizing and sorting of a full build.
+        """
+        index = ProjectSearchIndex.__new__(ProjectSearchIndex)
+        index.projects = projects
+        index.fields = list(self.fields)
+        index.ids = self.ids
+        index.tokens = dict(self.tokens)
+        index.grams = dict(self.grams)
+        index.vocabulary = self.vocabulary
+        index.id_vocabulary = self.id_vocabulary
+        new_tokens = []
+
+        for doc in docs:
+            values = search_values(projects[doc])
+            old_values = index.fields[doc] if doc < len(index.fields) else None
+            if values == old_values:
+                continue
+            if old_values is None:
+                index.fields.append(values)
+                old_values = ('',) * len(values)
+            else:
+                index.fields[doc] = values
+
+            if values[0] not in index.ids:
+                if index.ids is self.ids:
+                    index.ids = dict(self.ids)
+                    index.id_vocabulary = list(self.id_vocabulary)
+                index.ids[values[0]] = doc
+                bisect.insort(index.id_vocabulary, values[0])
+
+            old_positions, positions = _token_positions(old_values), _token_positions(values)
+            for token in old_positions.keys() | positions.keys():
+                position = positions.get(token)
+                if position == old_positions.get(token):
+                    continue
+                postings = dict(index.tokens.get(token, ()))
+                if position is None:
+                    postings.pop(doc, None)
+                else:
+                    postings[doc] = position
+                    if token not in index.tokens:
+                        new_tokens.append(token)
+                index.tokens[token] = postings
+
+            old_grams, grams = _all_trigrams(old_values), _all_trigrams(values)
+            for gram in old_grams - grams:
+                index.grams[gram] = index.grams[gram] - {doc}
+            for gram in grams - old_grams:
+                index.grams[gram] = index.grams.get(gram, set()) | {doc}
+
+        if new_tokens:
+            index.vocabulary = list(self.vocabulary)
+            for token in new_tokens:
+                bisect.insort(index.vocabulary, token)
+        return index
+
+    def _prefix_range(self, vocabulary, prefix):
+        start = bisect.bisect_left(vocabulary, prefix)
+        end = bisect.bisect_left(vocabulary, prefix + '\uffff')
+        return vocabulary[start:end]
+
+    def _matches(self, doc, query):
+        return any(query in value for value in self.fields[doc])
+
+    def _substring_candidates(self, query):
+        """Documents that may contain the query; every true match is included"""
+        if len(query) < GRAM:
+            return range(len(self.projects))
+        postings = []
+        for gram in _trigrams(query):
+            docs = self.grams.get(gram)
+            if not docs:
+                return []
+            postings.append(docs)
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for docs in postings[1:]:
+            candidates &= docs
+            if not candidates:
+                break
+        return sorted(candidates)
+
+    def _ranked(self, query):
+        """Yield matching documents best-first: id, id prefix, word prefix by field, then any substring"""
+        seen = set()
+
+        doc = self.ids.get(query)
+        if doc is not None:
+            seen.add(doc)
+            yield doc
+
+        for value in self._prefix_range(self.id_vocabulary, query):
+            doc = self.ids[value]
+            if doc not in seen:
+                seen.add(doc)
+                yield doc
+
+        # Word-prefix matches, grouped by the field the word appears in
+        if TOKEN_RE.fullmatch(query):
+            by_position = {}
+            for token in self._prefix_range(self.vocabulary, query):
+                for doc, position in self.tokens[token].items():
+                    if by_position.get(doc, position) >= position:
+                        by_position[doc] = position
+            for doc, _ in sorted(by_position.items(), key=lambda item: (item[1], item[0])):
+                if doc not in seen:
+                    seen.add(doc)
+                    yield doc
+
+        for doc in self._substring_candidates(query):
+            if doc not in seen and self._matches(doc, query):
+                seen.add(doc)
+                yield doc
+
+    def matching_docs(self, query):
+        """Positions of the projects containing query in any search field, in project order"""
+        query = query.lower()
+        return [doc for doc in self._substring_candidates(query) if self._matches(doc, query)]
+
+    def search(self, query, limit=None):
+        """Return projects containing query in any search field
+
+        Without a limit every match is returned in project order. With a limit the
+        best-ranked matches are returned and ranking stops as soon as it has enough.
+        """
+        if not query:
+            return list(self.projects[:limit] if limit else self.projects)
+
+        if limit is None:
+            return [self.projects[doc] for doc in self.matching_docs(query)]
+
+        query = query.lower()
+
+        results = []
+        for doc in self._ranked(query):
+            results.append(self.projects[doc])
+            if len(results) >= limit:
+                break
+        return results
@@ -0,0 +1,215 @@
+"""
+REMC Production Server
+Pre-forking, multi-threaded WSGI server that loads the data once before forking the workers
+
+Usage:
+    python serve.py                         # REMC_WORKERS / REMC_THREADS / PORT from the environment
+    python serve.py --workers 4 --threads 16 --port 8000
+
+The parent process binds the port and builds the data snapshots, then forks
+the workers. The workers share the parsed snapshots copy-on-write instead of
+each parsing the JSON files again. Every worker serves requests on a fixed-size
+thread pool, so a slow request only holds up its own thread, and accepts a
+connection only while one of its threads is free; the rest wait in the listen
+backlog for whichever worker frees a thread first. Dead workers are replaced;
+SIGTERM or Ctrl-C drains and stops them all.
+
+On platforms without fork() (Windows) a single process runs with the thread pool.
+"""
+
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+# Seconds a client may stall while sending its request before its pool thread is freed
+REQUEST_TIMEOUT = 5
+# A worker that dies sooner than this after starting is restarted with a delay
+MIN_WORKER_LIFETIME = 1.0
+
+
+class RequestHandler(WSGIRequestHandler):
+    """Werkzeug's handler with a socket timeout
+
+    Werkzeug closes the connection after every response, so there is no
+    keep-alive; the timeout only bounds a slow or stalled client.
+    """
+
+    timeout = REQUEST_TIMEOUT
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """WSGI server handling each connection on a fixed-size thread pool
+
+    A connection is accepted only when a pool thread is free for it, so the
+    pool's queue never grows past the number of threads.
+    """
+
+    multithread = True
+
+    def __init__(self, app, listener, threads, multiprocess=False):
+        self.multiprocess = multiprocess
+        host, port = listener.getsockname()[:2]
+        super().__init__(host, port, app, handler=RequestHandler, fd=listener.fileno())
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='remc-http')
+        self.free_threads = threading.BoundedSemaphore(threads)
+
+    def get_request(self):
+        # Wait for a free thread before accepting. The listener is non-blocking, so if another
+        # worker took the connection meanwhile accept() raises and serve_forever() goes back to select()
+        self.free_threads.acquire()
+        try:
+            return super().get_request()
+        except BaseException:
+            self.free_threads.release()
+            raise
+
+    def process_request(self, request, client_address):
+        try:
+            self.pool.submit(self._process_request, request, client_address)
+        except BaseException:
+            # Never reached the pool (shutting down); the caller closes the connection
+            self.free_threads.release()
+            raise
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.free_threads.release()
+
+
+def create_listener(host, port, backlog=1024):
+    listener = socket.create_server((host, port), backlog=backlog)
+    listener.set_inheritable(True)
+    # Every worker wakes for a new connection but only one gets it; the others must not block in accept()
+    listener.setblocking(False)
+    return listener
+
+
+def _serve_worker(app, listener, threads, multiprocess):
+    """Serve on the shared listening socket until SIGTERM / SIGINT"""
+    server = PooledWSGIServer(app, listener, threads, multiprocess)
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever() to return, so it can't run on this thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        server.serve_forever()
+    finally:
+        # Let requests already being handled finish
+        server.pool.shutdown(wait=True)
+
+
+def serve(app, host='0.0.0.0', port=5000, workers=2, threads=8, preload=None, post_fork=None, supervise=None):
+    """Run app with `workers` processes of `threads` threads each
+
+    preload() is called once in the parent before forking so the workers start
+    with the data already parsed. post_fork() is called in each worker (or the
+    single process) before it serves, to start per-process background threads.
+    supervise() is called once in the parent after the first workers are forked
+    (or in the single process), for background work shared by all the workers.
+    """
+    listener = create_listener(host, port)
+    if preload is not None:
+        started = time.perf_counter()
+        preload()
+        print(f"Preloaded data in {time.perf_counter() - started:.2f}s")
+
+    if workers <= 1 or not hasattr(os, 'fork'):
+        if post_fork is not None:
+            post_fork()
+        if supervise is not None:
+            supervise()
+        print(f"Serving on http://{host}:{port} with {threads} threads")
+        _serve_worker(app, listener, threads, multiprocess=False)
+        return
+
+    # Move everything loaded so far out of the collector's reach; otherwise the first
+    # collection in each worker touches every object and un-shares the pages
+    gc.collect()
+    gc.freeze()
+
+    children = {}
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                if post_fork is not None:
+                    post_fork()
+                _serve_worker(app, listener, threads, multiprocess=True)
+            except BaseException as e:
+                print(f"Error in worker {os.getpid()}: {e}")
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        children[pid] = time.monotonic()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    print(f"Serving on http://{host}:{port} with {workers} workers x {threads} threads")
+    for _ in range(workers):
+        spawn()
+    if supervise is not None:
+        supervise()
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        started = children.pop(pid, None)
+        if started is None or stopping:
+            continue
+        print(f"Worker {pid} exited with status {status}, restarting")
+        if time.monotonic() - started < MIN_WORKER_LIFETIME:
+            time.sleep(MIN_WORKER_LIFETIME)
+        spawn()
+    listener.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the REMC web app with the production server')
+    parser.add_argument('--host', default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5000)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('REMC_WORKERS', os.cpu_count() or 1)))
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('REMC_THREADS', 8)))
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from app import app, remc_manager, start_data_watcher, start_import_watcher
+    serve(app, args.host, args.port, args.workers, args.threads, preload=remc_manager.preload,
+          post_fork=start_data_watcher, supervise=start_import_watcher)
+
+
+if __name__ == '__main__':
+    main()
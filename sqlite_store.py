@@ -0,0 +1,451 @@
+"""
+REMC SQLite Storage
+Optional SQLite (WAL mode) backend for projects and email tracking, imported from the JSON files and
+re-imported when they change
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+from project_index import ProjectIndex
+from records import EmailRecord, Project
+from search import GRAM, SEARCH_FIELDS, match_rank
+from store import (ACTIVE_STATUSES, COMPLETED_STATUSES, RECENT_DAYS, decode_cursor, encode_cursor, file_signature,
+                   iter_email_records, load_commercial_projects, load_residential_projects, parse_received_time)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS projects (
+    seq INTEGER PRIMARY KEY,
+    id TEXT NOT NULL,
+    type TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT '',
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_projects_id ON projects(id);
+CREATE INDEX IF NOT EXISTS idx_projects_status ON projects(status);
+CREATE INDEX IF NOT EXISTS idx_projects_type ON projects(type);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS projects_fts USING fts5(
+    id, name, description, client, location,
+    tokenize = 'trigram'
+);
+
+CREATE TABLE IF NOT EXISTS emails (
+    seq INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    tracked_project_id TEXT,
+    received_at REAL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_emails_project ON emails(tracked_project_id, received_at DESC);
+CREATE INDEX IF NOT EXISTS idx_emails_received ON emails(received_at);
+CREATE INDEX IF NOT EXISTS idx_emails_order ON emails(received_at DESC, id);
+'''
+
+# Most recent first, then by id, emails without a parseable time last
+EMAIL_ORDER = 'received_at IS NULL, received_at DESC, id'
+# Per-project lists break ties in file order, like the in-memory index
+PROJECT_EMAIL_ORDER = 'received_at IS NULL, received_at DESC, seq'
+
+
+class SQLiteStorage:
+    """A SQLite database holding projects and tracked emails"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self.init_schema()
+
+    def connection(self):
+        """Return this thread's connection, opening it on first use
+
+        Connections are per process as well as per thread: SQLite connections
+        must not be used across fork(), so a forked worker opens its own.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def close(self):
+        """Close this thread's connection, if it has one; the next connection() opens a new one"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            conn.close()
+        self._local.conn = None
+
+    def init_schema(self):
+        conn = self.connection()
+        conn.executescript(SCHEMA)
+        conn.commit()
+
+    @property
+    def version(self):
+        """Import counter, bumped every time the data is replaced"""
+        row = self.connection().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return int(row[0]) if row else 0
+
+    @property
+    def imported_at(self):
+        """Epoch seconds of the last import, or None"""
+        row = self.connection().execute("SELECT value FROM meta WHERE key = 'imported_at'").fetchone()
+        return float(row[0]) if row else None
+
+    def source_signatures(self):
+        """(mtime_ns, size) of each JSON file as of the last import, or None before the first"""
+        row = self.connection().execute("SELECT value FROM meta WHERE key = 'sources'").fetchone()
+        return json.loads(row[0]) if row else None
+
+    def import_json(self, residential_file, app_data_file, email_file, only_if_changed=False):
+        """Replace the database contents with the data in the JSON files; returns True if it imported
+
+        With only_if_changed the import is skipped when the files are unchanged
+        since the last one (by mtime and size).
+        """
+        # Taken before reading, so a change made during the import is picked up by the next check
+        signatures = [file_signature(path) for path in (residential_file, app_data_file, email_file)]
+        signatures = [list(sig) if sig else None for sig in signatures]
+        if only_if_changed and self.source_signatures() == signatures:
+            return False
+        email_count = 0
+
+        conn = self.connection()
+        with conn:
+            # The write lock is taken first, so importers in several worker processes run one at a time
+            # and the ones that waited see the import already done
+            conn.execute('BEGIN IMMEDIATE')
+            if only_if_changed and self.source_signatures() == signatures:
+                return False
+            projects = load_residential_projects(residential_file)
+            projects.extend(load_commercial_projects(app_data_file))
+            conn.execute('DELETE FROM projects')
+            conn.execute('DELETE FROM projects_fts')
+            conn.execute('DELETE FROM emails')
+
+            conn.executemany(
+                'INSERT INTO projects (seq, id, type, status, data) VALUES (?, ?, ?, ?, ?)',
+                ((seq, project['id'], project['type'], str(project.get('status') or '').lower(),
+                  json.dumps(project.to_dict()))
+                 for seq, project in enumerate(projects))
+            )
+            conn.executemany(
+                'INSERT INTO projects_fts (rowid, id, name, description, client, location) VALUES (?, ?, ?, ?, ?, ?)',
+                ((seq,) + tuple(str(project.get(field, '')).lower() for field in SEARCH_FIELDS)
+                 for seq, project in enumerate(projects))
+            )
+            # Emails are streamed from the file straight into the table
+            try:
+                if os.path.exists(email_file):
+                    for email_count, (email_id, email) in enumerate(iter_email_records(email_file), 1):
+                        conn.execute(
+                            'INSERT INTO emails (seq, id, tracked_project_id, received_at, data) VALUES (?, ?, ?, ?, ?)',
+                            (email_count, email_id, email.get('tracked_project_id'),
+                             parse_received_time(email.get('received_time')), json.dumps(email.to_dict()))
+                        )
+            except Exception as e:
+                print(f"Error loading email tracking: {e}")
+                raise
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('version', '1') "
+                "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+            )
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('imported_at', ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value", (str(time.time()),)
+            )
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('sources', ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value", (json.dumps(signatures),)
+            )
+        print(f"Imported {len(projects)} projects and {email_count} emails into {self.path}")
+        return True
+
+
+class SQLiteSource:
+    """The JSON files a SQLiteStorage is imported from, re-imported whenever they change
+
+    It has the paths / refresh() / watched interface of a file-backed store, so
+    the DataWatcher keeps the database in step with the files the tracker writes.
+    One process watching is enough for every process reading the database; serve.py
+    runs it in the parent, which must not hold a connection when it forks a worker.
+    So the connection is closed after each import, and a fork waits for an import
+    in progress to finish.
+    """
+
+    def __init__(self, storage, residential_file, app_data_file, email_file):
+        self.storage = storage
+        self.paths = [residential_file, app_data_file, email_file]
+        self.watched = False
+        # File signatures at the last check, so an unchanged check doesn't open the database
+        self._signatures = None
+        self._lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(before=self._lock.acquire, after_in_parent=self._lock.release,
+                                after_in_child=self._lock.release)
+
+    def refresh(self):
+        """Re-import if the files changed since the last import; returns True when it did"""
+        signatures = [file_signature(path) for path in self.paths]
+        if signatures == self._signatures:
+            return False
+        with self._lock:
+            try:
+                imported = self.storage.import_json(*self.paths, only_if_changed=True)
+            finally:
+                self.storage.close()
+        self._signatures = signatures
+        return imported
+
+
+class SQLiteBackedStore:
+    """Shared plumbing for the SQLite store interfaces"""
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    @property
+    def version(self):
+        return self.storage.version
+
+    def data_version(self):
+        """Version token for HTTP validators"""
+        return f'sqlite.{self.storage.version}'
+
+    def last_modified(self):
+        """Epoch seconds of the last import, or None"""
+        return self.storage.imported_at
+
+    def stats(self):
+        return {'backend': 'sqlite', 'version': self.version}
+
+    # Record type each row is loaded as
+    record = None
+
+    def _rows(self, sql, params=()):
+        return [self.record(json.loads(row[0])) for row in self.storage.connection().execute(sql, params)]
+
+
+class SQLiteProjectStore(SQLiteBackedStore):
+    """Project store interface backed by SQLiteStorage"""
+
+    record = Project
+
+    def __init__(self, storage):
+        super().__init__(storage)
+        # (database version, ProjectIndex) for filtered listings
+        self._query_index = None
+        self._query_index_lock = threading.Lock()
+
+    def all(self):
+        """Return a list of all projects (residential first, then commercial)"""
+        return self._rows('SELECT data FROM projects ORDER BY seq')
+
+    def get(self, project_id):
+        """Return a single project by id, or None"""
+        rows = self._rows('SELECT data FROM projects WHERE id = ? ORDER BY seq LIMIT 1', (project_id,))
+        return rows[0] if rows else None
+
+    def search(self, query, limit=None):
+        """Return projects containing query in any search field, ranked when a limit is given"""
+        if not query:
+            if limit:
+                return self._rows('SELECT data FROM projects ORDER BY seq LIMIT ?', (limit,))
+            return self.all()
+
+        ranked = self._ranked_seqs(query.lower())
+        if limit is not None:
+            ranked = sorted(ranked)[:limit]
+
+        return self._by_seq([seq for _, seq in ranked])
+
+    def _ranked_seqs(self, query):
+        """[(rank, seq)] of the projects matching a lowercased query, in seq order"""
+        conn = self.storage.connection()
+        if len(query) >= GRAM:
+            # Trigram FTS narrows the candidates; the exact match is checked below
+            phrase = '"' + query.replace('"', '""') + '"'
+            rows = conn.execute(
+                'SELECT rowid, id, name, description, client, location FROM projects_fts '
+                'WHERE projects_fts MATCH ? ORDER BY rowid', (phrase,)
+            )
+        else:
+            rows = conn.execute(
+                'SELECT rowid, id, name, description, client, location FROM projects_fts ORDER BY rowid'
+            )
+
+        ranked = []
+        for row in rows:
+            rank = match_rank(row[1:], query)
+            if rank is not None:
+                ranked.append((rank, row[0]))
+        return ranked
+
+    def _by_seq(self, seqs):
+        found = {}
+        conn = self.storage.connection()
+        # Stay well under SQLite's bound-parameter limit
+        for start in range(0, len(seqs), 500):
+            chunk = seqs[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            for seq, data in conn.execute(f'SELECT seq, data FROM projects WHERE seq IN ({placeholders})', chunk):
+                found[seq] = Project(json.loads(data))
+        return [found[seq] for seq in seqs]
+
+    def query_index(self):
+        """Return the filter / sort index of all projects, rebuilt when the database changes"""
+        version = self.version
+        cached = self._query_index
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        with self._query_index_lock:
+            cached = self._query_index
+            if cached is None or cached[0] != version:
+                rows = self.storage.connection().execute('SELECT seq, data FROM projects ORDER BY seq').fetchall()
+                index = ProjectIndex([Project(json.loads(data)) for _, data in rows], _SeqSearch(self, rows))
+                cached = self._query_index = (version, index)
+        return cached[1]
+
+    def query(self, query):
+        """Return (projects, next_cursor, total) for one page of a ProjectQuery"""
+        return self.query_index().page(query)
+
+    def counts(self):
+        """Return the project counters used by the dashboard"""
+        active = ','.join('?' * len(ACTIVE_STATUSES))
+        completed = ','.join('?' * len(COMPLETED_STATUSES))
+        row = self.storage.connection().execute(
+            f"SELECT COUNT(*), "
+            f"COALESCE(SUM(status IN ({active})), 0), "
+            f"COALESCE(SUM(status IN ({completed})), 0), "
+            f"COALESCE(SUM(type = 'Residential'), 0), "
+            f"COALESCE(SUM(type = 'Commercial'), 0) FROM projects",
+            ACTIVE_STATUSES + COMPLETED_STATUSES
+        ).fetchone()
+        return {
+            'total_projects': row[0],
+            'active_projects': row[1],
+            'completed_projects': row[2],
+            'residential_projects': row[3],
+            'commercial_projects': row[4],
+        }
+
+
+class _SeqSearch:
+    """Search for ProjectIndex answered by the FTS table, mapping rows to list positions"""
+
+    def __init__(self, store, rows):
+        self.store = store
+        self.positions = {seq: doc for doc, (seq, _) in enumerate(rows)}
+
+    def matching_docs(self, query):
+        return sorted(self.positions[seq] for _, seq in self.store._ranked_seqs(query.lower())
+                      if seq in self.positions)
+
+
+class SQLiteEmailStore(SQLiteBackedStore):
+    """Email store interface backed by SQLiteStorage"""
+
+    record = EmailRecord
+
+    def all(self):
+        """Return a dict of all tracked emails keyed by email id"""
+        return {email['id']: email for email in self._rows('SELECT data FROM emails ORDER BY seq')}
+
+    def count(self):
+        """Return the number of tracked emails"""
+        return self.storage.connection().execute('SELECT COUNT(*) FROM emails').fetchone()[0]
+
+    def recent_count(self):
+        """Return the number of emails received within the last RECENT_DAYS days"""
+        cutoff = (datetime.now() - timedelta(days=RECENT_DAYS + 1)).timestamp()
+        return self.storage.connection().execute(
+            'SELECT COUNT(*) FROM emails WHERE received_at > ?', (cutoff,)
+        ).fetchone()[0]
+
+    def newest_first(self):
+        """Return all tracked emails, most recent first"""
+        return self._rows(f'SELECT data FROM emails ORDER BY {EMAIL_ORDER}')
+
+    def for_project(self, project_id):
+        """Return the emails tracked against a project, most recent first"""
+        return self._rows(f'SELECT data FROM emails WHERE tracked_project_id = ? ORDER BY {PROJECT_EMAIL_ORDER}',
+                          (project_id,))
+
+    def get(self, email_id):
+        """Return a single email by id, or None"""
+        rows = self._rows('SELECT data FROM emails WHERE id = ?', (email_id,))
+        return rows[0] if rows else None
+
+    def page(self, cursor=None, limit=50):
+        """Return (emails, next_cursor) for one page, most recent first; raises ValueError for a bad cursor"""
+        where, params = '', []
+        if cursor:
+            received, email_id = decode_cursor(cursor)
+            if received is None:
+                where = 'WHERE received_at IS NULL AND id > ?'
+                params = [email_id]
+            else:
+                where = 'WHERE received_at IS NULL OR received_at < ? OR (received_at = ? AND id > ?)'
+                params = [received, received, email_id]
+
+        rows = self.storage.connection().execute(
+            f'SELECT received_at, id, data FROM emails {where} ORDER BY {EMAIL_ORDER} LIMIT ?', params + [limit + 1]
+        ).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][0], rows[-1][1])
+        return [EmailRecord(json.loads(row[2])) for row in rows], next_cursor
+
+    def changes_since(self, since=None):
+        """Delta since a change token; the database version is the token, so any re-import asks clients to reload"""
+        version = self.data_version()
+        return {'seq': version, 'reset': since is not None and since != version,
+                'added': [], 'changed': [], 'removed': []}
+
+    def received_after(self, timestamp):
+        """Return emails received after an epoch timestamp, most recent first"""
+        return self._rows(f'SELECT data FROM emails WHERE received_at > ? ORDER BY {EMAIL_ORDER}', (timestamp,))
+
+    def overview(self):
+        """Totals shown above the email list"""
+        conn = self.storage.connection()
+        total, with_attachments = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(json_array_length(data, '$.attachments') > 0), 0) FROM emails"
+        ).fetchone()
+        project_ids = [row[0] for row in conn.execute(
+            "SELECT DISTINCT tracked_project_id FROM emails "
+            "WHERE tracked_project_id IS NOT NULL AND tracked_project_id != '' ORDER BY tracked_project_id"
+        )]
+        return {
+            'total_emails': total,
+            'with_attachments': with_attachments,
+            'project_ids': project_ids,
+        }
+
+
+if __name__ == '__main__':
+    # Usage: python sqlite_store.py [database] [data directory]
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    db_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(base_dir, 'remc.db')
+    data_dir = sys.argv[2] if len(sys.argv) > 2 else base_dir
+
+    SQLiteStorage(db_path).import_json(
+        os.path.join(data_dir, 'residential_data.json'),
+        os.path.join(data_dir, 'app_data.json'),
+        os.path.join(data_dir, 'email_tracking.json')
+    )
@@ -1,32 +1,62 @@
 // Service Worker for REMC PWA - Native App Experience
-const CACHE_NAME = 'remc-pwa-v2';
-const STATIC_CACHE = 'remc-static-v2';
-const DYNAMIC_CACHE = 'remc-dynamic-v2';
+const CACHE_VERSION = 'v4';
+const STATIC_CACHE = `remc-static-${CACHE_VERSION}`;
+const PAGES_CACHE = `remc-pages-${CACHE_VERSION}`;
+const API_CACHE = `remc-api-${CACHE_VERSION}`;
 
-const urlsToCache = [
-  '/',
-  '/projects',
-  '/emails',
-  '/help',
-  '/settings',
-  '/install',
+// Entry limits; the least recently fetched entries are dropped first
+const CACHE_LIMITS = {
+  [PAGES_CACHE]: 30,
+  [API_CACHE]: 60
+};
+
+// Cached pages and API responses older than this are only used when offline
+const MAX_STALE_MS = 24 * 60 * 60 * 1000;
+
+// Sent by the server on every response; changes whenever the data or the app changes
+const DATA_VERSION_HEADER = 'X-REMC-Data-Version';
+const CACHED_AT_HEADER = 'X-SW-Cached-At';
+
+const staticUrls = [
   '/static/manifest.json',
   '/static/icon-192.svg',
-  '/static/sw.js',
   'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css',
   'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css',
   'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js'
 ];
 
+// Only files under /static/ and from these origins are cached cache-first, in STATIC_CACHE
+const CDN_ORIGINS = ['https://cdn.jsdelivr.net', 'https://cdnjs.cloudflare.com'];
+
+const pageUrls = [
+  '/',
+  '/projects',
+  '/emails',
+  '/help',
+  '/settings',
+  '/install'
+];
+
+// Pages and API responses served stale-while-revalidate
+const SWR_API_PATHS = ['/api/stats'];
+// API responses that must always come from the network
+const NO_CACHE_API_PATHS = ['/api/emails/refresh', '/api/cache/stats'];
+// Content-hashed static files (name.0123456789.ext) never change; a new hash replaces the old copy
+const HASHED_ASSET = /^(\/static\/.+)\.[0-9a-f]{10}(\.[a-z0-9]+)$/;
+
+// Data version of the newest response seen from the server
+let currentDataVersion = null;
+
 // Install event - cache critical resources
 self.addEventListener('install', function(event) {
   console.log('REMC Service Worker: Installing...');
   event.waitUntil(
-    caches.open(STATIC_CACHE)
-      .then(function(cache) {
-        console.log('REMC Service Worker: Caching app shell');
-        return cache.addAll(urlsToCache);
-      })
+    Promise.all([
+      caches.open(STATIC_CACHE).then(cache => cache.addAll(staticUrls)),
+      caches.open(PAGES_CACHE).then(cache => Promise.all(
+        pageUrls.map(url => fetch(url).then(response => putStamped(cache, url, response)))
+      ))
+    ])
       .then(() => {
         console.log('REMC Service Worker: Installed successfully');
         return self.skipWaiting(); // Activate immediately
@@ -37,11 +67,12 @@ self.addEventListener('install', function(event) {
 // Activate event - clean up old caches
 self.addEventListener('activate', function(event) {
   console.log('REMC Service Worker: Activating...');
+  const current = [STATIC_CACHE, PAGES_CACHE, API_CACHE];
   event.waitUntil(
     caches.keys().then(function(cacheNames) {
       return Promise.all(
         cacheNames.map(function(cacheName) {
-          if (cacheName !== STATIC_CACHE && cacheName !== DYNAMIC_CACHE) {
+          if (!current.includes(cacheName)) {
             console.log('REMC Service Worker: Deleting old cache', cacheName);
             return caches.delete(cacheName);
           }
@@ -54,65 +85,187 @@ self.addEventListener('activate', function(event) {
   );
 });
 
-// Fetch event - serve from cache with network fallback
+// Fetch event - pick a strategy per kind of request
 self.addEventListener('fetch', function(event) {
-  const requestUrl = new URL(event.request.url);
-  
-  // Handle API requests with network-first strategy
-  if (requestUrl.pathname.startsWith('/api/')) {
-    event.respondWith(
-      fetch(event.request)
-        .then(response => {
-          // Clone response for cache
-          const responseClone = response.clone();
-          caches.open(DYNAMIC_CACHE).then(cache => {
-            cache.put(event.request, responseClone);
-          });
-          return response;
-        })
-        .catch(() => {
-          // Fallback to cache if network fails
-          return caches.match(event.request);
-        })
-    );
+  const request = event.request;
+  if (request.method !== 'GET') {
     return;
   }
-  
-  // Handle all other requests with cache-first strategy
-  event.respondWith(
-    caches.match(event.request)
-      .then(function(response) {
-        if (response) {
-          console.log('REMC Service Worker: Serving from cache', event.request.url);
-          return response;
-        }
-        
-        console.log('REMC Service Worker: Fetching from network', event.request.url);
-        return fetch(event.request).then(response => {
-          // Don't cache non-successful responses
-          if (!response || response.status !== 200 || response.type !== 'basic') {
-            return response;
-          }
-          
-          // Clone the response for caching
-          const responseToCache = response.clone();
-          caches.open(DYNAMIC_CACHE).then(cache => {
-            cache.put(event.request, responseToCache);
-          });
-          
-          return response;
-        });
-      })
-      .catch(error => {
-        console.log('REMC Service Worker: Fetch failed', error);
-        // Return offline page for navigation requests
-        if (event.request.destination === 'document') {
-          return caches.match('/');
-        }
-      })
-  );
+  const requestUrl = new URL(request.url);
+  const sameOrigin = requestUrl.origin === self.location.origin;
+
+  if (sameOrigin && requestUrl.pathname.startsWith('/api/')) {
+    if (NO_CACHE_API_PATHS.includes(requestUrl.pathname)) {
+      return;
+    }
+    if (SWR_API_PATHS.includes(requestUrl.pathname)) {
+      event.respondWith(staleWhileRevalidate(event, API_CACHE));
+    } else {
+      event.respondWith(networkFirst(request, API_CACHE));
+    }
+    return;
+  }
+
+  if (sameOrigin && (request.mode === 'navigate' || pageUrls.includes(requestUrl.pathname))) {
+    event.respondWith(staleWhileRevalidate(event, PAGES_CACHE));
+    return;
+  }
+
+  // Static files and CDN assets: cache-first
+  if ((sameOrigin && requestUrl.pathname.startsWith('/static/')) || CDN_ORIGINS.includes(requestUrl.origin)) {
+    event.respondWith(cacheFirst(request));
+  }
+  // Anything else (blob downloads, /healthz, /metrics, ...) goes to the network untouched
 });
 
+// Copy of a response stamped with the time it was cached
+function stamp(response) {
+  const headers = new Headers(response.headers);
+  headers.set(CACHED_AT_HEADER, String(Date.now()));
+  return response.blob().then(body => new Response(body, {
+    status: response.status,
+    statusText: response.statusText,
+    headers: headers
+  }));
+}
+
+// Store a response, re-inserting it so the cache's key order tracks recency, then enforce the limit
+function putStamped(cache, request, response) {
+  if (!response || response.status !== 200 || response.type !== 'basic') {
+    return Promise.resolve();
+  }
+  return stamp(response)
+    .then(stamped => cache.delete(request).then(() => cache.put(request, stamped)))
+    .then(() => trimCache(cache, CACHE_LIMITS[cache.name]));
+}
+
+// Drop the oldest entries beyond the limit; cache.keys() lists entries in insertion order
+function trimCache(cache, limit) {
+  if (!limit) {
+    return Promise.resolve();
+  }
+  return cache.keys().then(keys => {
+    const excess = keys.length - limit;
+    return Promise.all(keys.slice(0, Math.max(excess, 0)).map(key => cache.delete(key)));
+  });
+}
+
+function isFresh(response) {
+  if (!response) {
+    return false;
+  }
+  const cachedAt = Number(response.headers.get(CACHED_AT_HEADER) || 0);
+  if (Date.now() - cachedAt > MAX_STALE_MS) {
+    return false;
+  }
+  // A response from an older data version is stale as soon as we know a newer one exists
+  const version = response.headers.get(DATA_VERSION_HEADER);
+  return !currentDataVersion || !version || version === currentDataVersion;
+}
+
+// Remember the server's data version; when it changes, drop entries from other versions and tell the pages
+function noteDataVersion(response) {
+  const version = response && response.headers.get(DATA_VERSION_HEADER);
+  if (!version || version === currentDataVersion) {
+    return Promise.resolve();
+  }
+  const previous = currentDataVersion;
+  currentDataVersion = version;
+  if (!previous) {
+    return Promise.resolve();
+  }
+  return Promise.all([PAGES_CACHE, API_CACHE].map(name => purgeOtherVersions(name, version)))
+    .then(() => self.clients.matchAll())
+    .then(clients => clients.forEach(client => client.postMessage({type: 'remc-data-version', version: version})));
+}
+
+function purgeOtherVersions(cacheName, version) {
+  return caches.open(cacheName).then(cache => cache.keys().then(keys => Promise.all(keys.map(key =>
+    cache.match(key).then(response => {
+      const cachedVersion = response && response.headers.get(DATA_VERSION_HEADER);
+      if (cachedVersion && cachedVersion !== version) {
+        return cache.delete(key);
+      }
+    })
+  ))));
+}
+
+function fetchAndCache(request, cacheName) {
+  return fetch(request).then(response => {
+    const copy = response.clone();
+    const updated = noteDataVersion(response)
+      .then(() => caches.open(cacheName))
+      .then(cache => putStamped(cache, request, copy));
+    return {response: response, updated: updated};
+  });
+}
+
+// Serve the cached copy at once and refresh it in the background; wait for the network only without a usable copy
+function staleWhileRevalidate(event, cacheName) {
+  const request = event.request;
+  return caches.open(cacheName).then(cache => cache.match(request)).then(cached => {
+    const network = fetchAndCache(request, cacheName);
+    if (cached && isFresh(cached)) {
+      event.waitUntil(network.then(result => result.updated).catch(() => {}));
+      return cached;
+    }
+    return network
+      .then(result => {
+        event.waitUntil(result.updated);
+        return result.response;
+      })
+      .catch(() => cached || offlineFallback(request));
+  });
+}
+
+function networkFirst(request, cacheName) {
+  return fetchAndCache(request, cacheName)
+    .then(result => result.response)
+    .catch(() => caches.open(cacheName).then(cache => cache.match(request)));
+}
+
+function cacheFirst(request) {
+  return caches.match(request).then(cached => {
+    if (cached) {
+      return cached;
+    }
+    return fetch(request).then(response => {
+      // Don't cache non-successful or opaque responses
+      if (response && response.status === 200 && (response.type === 'basic' || response.type === 'cors')) {
+        const copy = response.clone();
+        caches.open(STATIC_CACHE)
+          .then(cache => removeOtherHashes(cache, request).then(() => cache.put(request, copy)));
+      }
+      return response;
+    });
+  }).catch(error => {
+    console.log('REMC Service Worker: Fetch failed', error);
+    return offlineFallback(request);
+  });
+}
+
+// Drop earlier builds of a content-hashed file (same name, different hash)
+function removeOtherHashes(cache, request) {
+  const match = new URL(request.url).pathname.match(HASHED_ASSET);
+  if (!match) {
+    return Promise.resolve();
+  }
+  return cache.keys().then(keys => Promise.all(keys.map(key => {
+    const other = new URL(key.url).pathname.match(HASHED_ASSET);
+    if (other && other[1] === match[1] && other[2] === match[2] && key.url !== request.url) {
+      return cache.delete(key);
+    }
+  })));
+}
+
+function offlineFallback(request) {
+  // Return the cached dashboard for navigation requests
+  if (request.mode === 'navigate' || request.destination === 'document') {
+    return caches.open(PAGES_CACHE).then(cache => cache.match('/'));
+  }
+  return Response.error();
+}
+
 // Background sync for when app comes back online
 self.addEventListener('sync', function(event) {
   console.log('REMC Service Worker: Background sync triggered');
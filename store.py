@@ -0,0 +1,903 @@
+"""
+REMC Data Stores
+In-memory copies of the REMC JSON data files, reparsed only when a file changes on disk
+"""
+
+import base64
+import bisect
+import copy
+import json
+import math
+import os
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+
+from journal import write_json_atomic
+from json_stream import iter_file_members, load_file
+from project_index import ProjectIndex
+from records import EmailRecord, Project
+from search import ProjectSearchIndex
+
+
+def file_signature(path):
+    """Return (mtime_ns, size) for a file, or None if it does not exist"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _signature_token(signature):
+    return '0' if signature is None else f'{signature[0]:x}.{signature[1]:x}'
+
+
+class FileBackedStore:
+    """Base class for a snapshot built from one or more files and rebuilt when any of them change
+
+    Snapshots are never modified once published; a reload builds a new one and
+    swaps the reference, so readers never need the lock.
+
+    With a journal, changes made through the app are replayed over the files.
+    When only the journal has grown, just the new entries are applied to the
+    current snapshot instead of reparsing the files.
+    """
+
+    def __init__(self, paths, journal=None):
+        self.paths = list(paths)
+        self.journal = journal
+        if journal is not None:
+            # Last, so the data files' signatures can be compared without it
+            self.paths.append(journal.path)
+        self._lock = threading.Lock()
+        self._snapshot = None
+        # Set while a background watcher keeps the snapshot fresh; requests then skip the stat calls
+        self.watched = False
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        # Seconds the last rebuild took
+        self.reload_seconds = 0.0
+
+    def _current_signatures(self):
+        return tuple(file_signature(path) for path in self.paths)
+
+    def _build(self):
+        """Parse the source files into a new snapshot (implemented by subclasses)"""
+        raise NotImplementedError
+
+    def _apply(self, snapshot, entries):
+        """New snapshot with journal entries applied (implemented by subclasses that take a journal)"""
+        raise NotImplementedError
+
+    def snapshot(self):
+        """Return the current snapshot, reparsing the files first if they changed"""
+        snapshot = self._snapshot
+        if snapshot is not None and (self.watched or self._current_signatures() == snapshot.signatures):
+            self.hits += 1
+            return snapshot
+
+        self.misses += 1
+        return self._reload()
+
+    def refresh(self):
+        """Reparse the files if they changed; returns True when a new snapshot was swapped in"""
+        snapshot = self._snapshot
+        if snapshot is not None and self._current_signatures() == snapshot.signatures:
+            return False
+        return self._reload() is not snapshot
+
+    def _reload(self):
+        with self._lock:
+            # Another thread may have reloaded while we waited for the lock
+            signatures = self._current_signatures()
+            current = self._snapshot
+            if current is not None and signatures == current.signatures:
+                return current
+
+            started = time.perf_counter()
+            snapshot = None
+            if (self.journal is not None and current is not None
+                    and signatures[:-1] == current.signatures[:-1]):
+                # Only the journal changed: apply what was appended since the last read
+                entries, position = self.journal.read(current.journal_position)
+                if entries is not None:
+                    snapshot = self._apply(current, entries)
+            if snapshot is None:
+                snapshot = self._build()
+                position = None
+                if self.journal is not None:
+                    entries, position = self.journal.read()
+                    if entries:
+                        snapshot = self._apply(snapshot, entries)
+            snapshot.journal_position = position if self.journal is not None else None
+            self.reload_seconds = time.perf_counter() - started
+            # The signatures travel with the snapshot so both are swapped in one assignment
+            snapshot.signatures = signatures
+            self._finish(snapshot)
+            self.version += 1
+            self.reloads += 1
+            self._snapshot = snapshot
+            return snapshot
+
+    def _finish(self, snapshot):
+        """Last step before a new snapshot is published, once its signatures and journal position are set"""
+
+    def data_version(self):
+        """Version token derived from the source files' mtime and size, identical in every worker process"""
+        signatures = self.snapshot().signatures
+        return '-'.join(_signature_token(sig) for sig in signatures)
+
+    def last_modified(self):
+        """Latest mtime of the source files in epoch seconds, or None if none exist"""
+        mtimes = [sig[0] / 1e9 for sig in self.snapshot().signatures if sig]
+        return max(mtimes) if mtimes else None
+
+    def stats(self):
+        """Cache counters for monitoring"""
+        total = self.hits + self.misses
+        return {
+            'version': self.version,
+            'hits': self.hits,
+            'misses': self.misses,
+            'reloads': self.reloads,
+            'reload_seconds': round(self.reload_seconds, 4),
+            'hit_ratio': round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+# Threads used to parse several data files at once (1 loads them one after another)
+LOAD_WORKERS = int(os.environ.get('REMC_LOAD_WORKERS', 4))
+# Email files larger than this are streamed rather than decoded in one go
+STREAM_THRESHOLD = int(os.environ.get('REMC_STREAM_THRESHOLD_MB', 16)) * 1024 * 1024
+
+
+def load_concurrently(loaders):
+    """Call the zero-argument loaders in parallel threads and return their results in order
+
+    A fresh pool is used per call so this keeps working in forked worker processes.
+    """
+    if LOAD_WORKERS < 2 or len(loaders) < 2:
+        return [loader() for loader in loaders]
+    with ThreadPoolExecutor(max_workers=min(LOAD_WORKERS, len(loaders)), thread_name_prefix='remc-load') as pool:
+        futures = [pool.submit(loader) for loader in loaders]
+        return [future.result() for future in futures]
+
+
+def refresh_all(stores):
+    """Bring several stores up to date at once, e.g. for a cold start; returns the stores that reloaded"""
+    def refresh(store):
+        try:
+            return store.refresh()
+        except Exception as e:
+            print(f"Error reloading data: {e}")
+            return False
+    results = load_concurrently([partial(refresh, store) for store in stores])
+    return [store for store, reloaded in zip(stores, results) if reloaded]
+
+
+def load_residential_projects(path):
+    """Parse residential_data.json into Project records"""
+    projects = []
+    try:
+        if os.path.exists(path):
+            residential_data = load_file(path)
+            # Handle both list and dict formats
+            if isinstance(residential_data, dict):
+                for project_id, project in residential_data.items():
+                    if isinstance(project, dict):
+                        projects.append(Project(project, id=project_id, type='Residential'))
+            elif isinstance(residential_data, list):
+                for i, project in enumerate(residential_data):
+                    if isinstance(project, dict):
+                        projects.append(Project(project, id=project.get('id', f'RES-{i+1}'), type='Residential'))
+    except Exception as e:
+        print(f"Error loading residential data: {e}")
+    return projects
+
+
+def _residential_key(residential_data, project_id):
+    """Key (dict format) or index (list format) of a project in residential_data.json, or None"""
+    if isinstance(residential_data, dict):
+        return project_id if project_id in residential_data else None
+    for i, project in enumerate(residential_data):
+        if isinstance(project, dict) and project.get('id', f'RES-{i+1}') == project_id:
+            return i
+    return None
+
+
+def fold_project_entries(residential_file, app_data_file, entries):
+    """Write project journal entries into residential_data.json and app_data.json"""
+    residential_data = load_file(residential_file) if os.path.exists(residential_file) else {}
+    app_data = load_file(app_data_file) if os.path.exists(app_data_file) else {}
+    residential_changed = commercial_changed = False
+
+    for entry in entries:
+        if entry.get('op') != 'project':
+            continue
+        project_id, fields = entry['id'], entry.get('fields') or {}
+        if entry.get('type') == 'Commercial':
+            projects = app_data.setdefault('projects', {})
+            projects.setdefault(project_id, {}).update(fields)
+            commercial_changed = True
+        else:
+            key = _residential_key(residential_data, project_id)
+            if key is not None:
+                residential_data[key].update(fields)
+            elif isinstance(residential_data, dict):
+                residential_data[project_id] = dict(fields)
+            else:
+                residential_data.append(dict(fields, id=project_id))
+            residential_changed = True
+
+    if residential_changed:
+        write_json_atomic(residential_file, residential_data)
+    if commercial_changed:
+        write_json_atomic(app_data_file, app_data)
+
+
+def load_commercial_projects(path):
+    """Parse the projects section of app_data.json into Project records"""
+    projects = []
+    try:
+        if os.path.exists(path):
+            app_data = load_file(path)
+            commercial_projects = app_data.get('projects', {})
+            for project_id, project in commercial_projects.items():
+                if isinstance(project, dict):
+                    projects.append(Project(project, id=project_id, type='Commercial'))
+    except Exception as e:
+        print(f"Error loading commercial data: {e}")
+    return projects
+
+
+ACTIVE_STATUSES = ('active', 'in progress', 'ongoing')
+COMPLETED_STATUSES = ('completed', 'finished')
+
+
+class ProjectSnapshot:
+    """Immutable view of all projects at one point in time"""
+
+    def __init__(self, projects):
+        self.projects = projects
+        # Primary-key index; the first project wins if an id appears twice
+        self.by_id = {}
+        self.positions = {}
+        for i, project in enumerate(projects):
+            if project['id'] not in self.by_id:
+                self.by_id[project['id']] = project
+                self.positions[project['id']] = i
+        self.search_index = ProjectSearchIndex(projects)
+        self.counts = self._count(projects)
+        self._query_index = None
+        self._query_index_lock = threading.Lock()
+
+    @property
+    def query_index(self):
+        """Filter / sort index for project listings, built on first use"""
+        if self._query_index is None:
+            with self._query_index_lock:
+                if self._query_index is None:
+                    self._query_index = ProjectIndex(self.projects, self.search_index)
+        return self._query_index
+
+    def with_changes(self, changed):
+        """New snapshot with the given projects replacing those with the same id, or added at the end"""
+        snapshot = copy.copy(self)
+        snapshot.projects = projects = list(self.projects)
+        snapshot.by_id = dict(self.by_id)
+        snapshot.positions = dict(self.positions)
+        snapshot.counts = dict(self.counts)
+        snapshot._query_index_lock = threading.Lock()
+        docs = []
+        for project in changed:
+            project_id = project['id']
+            i = snapshot.positions.get(project_id)
+            if i is None:
+                snapshot.positions[project_id] = len(projects)
+                projects.append(project)
+                snapshot.counts['total_projects'] += 1
+            else:
+                self._tally(snapshot.counts, projects[i], -1)
+                projects[i] = project
+            docs.append(snapshot.positions[project_id])
+            snapshot.by_id[project_id] = project
+            self._tally(snapshot.counts, project, 1)
+        docs.sort()
+        snapshot.search_index = self.search_index.with_changes(projects, docs)
+        # Patched when this snapshot's index was built; otherwise built on first use
+        if self._query_index is not None:
+            snapshot._query_index = self._query_index.with_changes(projects, docs, snapshot.search_index)
+        return snapshot
+
+    @classmethod
+    def _count(cls, projects):
+        counts = {
+            'total_projects': len(projects),
+            'active_projects': 0,
+            'completed_projects': 0,
+            'residential_projects': 0,
+            'commercial_projects': 0,
+        }
+        for project in projects:
+            cls._tally(counts, project, 1)
+        return counts
+
+    @staticmethod
+    def _tally(counts, project, step):
+        status = str(project.get('status') or '').lower()
+        if status in ACTIVE_STATUSES:
+            counts['active_projects'] += step
+        elif status in COMPLETED_STATUSES:
+            counts['completed_projects'] += step
+        if project['type'] == 'Residential':
+            counts['residential_projects'] += step
+        elif project['type'] == 'Commercial':
+            counts['commercial_projects'] += step
+
+
+class ProjectStore(FileBackedStore):
+    """Residential and commercial projects, cached until either file changes"""
+
+    def __init__(self, residential_file, app_data_file, journal=None):
+        super().__init__([residential_file, app_data_file], journal)
+        self.residential_file = residential_file
+        self.app_data_file = app_data_file
+
+    def _build(self):
+        # Both files are parsed at once and merged in the usual residential-then-commercial order
+        projects, commercial = load_concurrently([
+            partial(load_residential_projects, self.residential_file),
+            partial(load_commercial_projects, self.app_data_file),
+        ])
+        projects.extend(commercial)
+        return ProjectSnapshot(projects)
+
+    def _apply(self, snapshot, entries):
+        changed = {}
+        for entry in entries:
+            if entry.get('op') != 'project':
+                continue
+            project_id = entry['id']
+            current = changed.get(project_id) or snapshot.by_id.get(project_id)
+            data = current.to_dict() if current is not None else {}
+            data.update(entry.get('fields') or {})
+            project_type = current['type'] if current is not None else entry.get('type', 'Residential')
+            changed[project_id] = Project(data, id=project_id, type=project_type)
+        if not changed:
+            return copy.copy(snapshot)
+        return snapshot.with_changes(changed.values())
+
+    def fold(self, entries):
+        """Write project journal entries into the JSON files (used by journal compaction)"""
+        fold_project_entries(self.residential_file, self.app_data_file, entries)
+
+    def all(self):
+        """Return a list of all projects (residential first, then commercial)"""
+        return list(self.snapshot().projects)
+
+    def get(self, project_id):
+        """Return a single project by id, or None"""
+        return self.snapshot().by_id.get(project_id)
+
+    def search(self, query, limit=None):
+        """Return projects matching query (see ProjectSearchIndex.search)"""
+        return self.snapshot().search_index.search(query, limit)
+
+    def counts(self):
+        """Return the precomputed project counters used by the dashboard"""
+        return self.snapshot().counts
+
+    def query_index(self):
+        """Return the filter / sort index of the current projects"""
+        return self.snapshot().query_index
+
+    def query(self, query):
+        """Return (projects, next_cursor, total) for one page of a ProjectQuery"""
+        return self.snapshot().query_index.page(query)
+
+
+def iter_email_records(path):
+    """Yield (email_id, email) from email_tracking.json one record at a time
+
+    Handles both list and dict formats; list entries are keyed by their index.
+    """
+    for key, email in iter_file_members(path, STREAM_THRESHOLD):
+        if isinstance(email, dict):
+            email_id = str(key)
+            yield email_id, EmailRecord(email, id=email_id)
+
+
+def fold_email_entries(path, entries):
+    """Write email tagging journal entries into email_tracking.json"""
+    tags = {entry['email_id']: entry.get('project_id') for entry in entries if entry.get('op') == 'tag'}
+    if not tags or not os.path.exists(path):
+        return
+    emails = load_file(path)
+    for email_id, project_id in tags.items():
+        try:
+            email = emails[int(email_id)] if isinstance(emails, list) else emails.get(email_id)
+        except (ValueError, IndexError):
+            email = None
+        if not isinstance(email, dict):
+            continue
+        if project_id:
+            email['tracked_project_id'] = project_id
+        else:
+            email.pop('tracked_project_id', None)
+    write_json_atomic(path, emails)
+
+
+def load_email_file(path):
+    """Parse email_tracking.json into a dict of email_id -> email"""
+    try:
+        if os.path.exists(path):
+            # Large files are streamed so peak memory is the parsed emails, not the file text as well
+            return dict(iter_email_records(path))
+    except Exception as e:
+        print(f"Error loading email tracking: {e}")
+    return {}
+
+
+RECEIVED_TIME_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d', '%d/%m/%Y %H:%M:%S', '%d/%m/%Y')
+RECENT_DAYS = 7
+
+# Zero-padded ISO patterns that datetime.fromisoformat() parses much faster than strptime
+_ISO_PATTERNS = ('9999-99-99 99:99:99', '9999-99-99')
+_DIGITS = str.maketrans('0123456789', '9999999999')
+
+# Format per input pattern, e.g. '99/99/9999' -> '%d/%m/%Y'. Only formats that have parsed a value
+# are cached, so an invalid date (e.g. 2024-02-31) seen first cannot poison its pattern
+_format_cache = {}
+_FORMAT_CACHE_LIMIT = 256
+
+
+def _detect_format(value):
+    for fmt in RECEIVED_TIME_FORMATS:
+        try:
+            datetime.strptime(value, fmt)
+            return fmt
+        except ValueError:
+            continue
+    return None
+
+
+def parse_received_time(value):
+    """Parse an email received_time into epoch seconds, or None if unrecognised"""
+    if not value or not isinstance(value, str):
+        return None
+
+    pattern = value.translate(_DIGITS)
+    fmt = _format_cache.get(pattern)
+    if fmt is None:
+        fmt = _detect_format(value)
+        if fmt is None:
+            return None
+        if len(_format_cache) < _FORMAT_CACHE_LIMIT:
+            _format_cache[pattern] = fmt
+
+    try:
+        if pattern in _ISO_PATTERNS:
+            return datetime.fromisoformat(value).timestamp()
+        return datetime.strptime(value, fmt).timestamp()
+    except ValueError:
+        # Right pattern but not a real date, e.g. 2024-02-31
+        return None
+
+
+NO_TIME = float('nan')
+
+
+class EmailSnapshot:
+    """Immutable view of tracked emails with a per-project index and a received-time column"""
+
+    # Above this fraction of changed emails a full index rebuild is cheaper than patching
+    REBUILD_THRESHOLD = 0.25
+
+    def __init__(self, emails, received, by_project):
+        self.emails = emails
+        # Email ids in file order; received[i] is the epoch time of order[i] (NaN if unparseable)
+        self.order = list(emails)
+        self.position = {email_id: i for i, email_id in enumerate(self.order)}
+        self.received = received
+        self.received_sorted = array('d', sorted(t for t in received if t == t))
+        # Positions of all emails ordered by (received_time desc, id), unparseable times last
+        self.newest_first = array('l', sorted(range(len(received)), key=self._newest_first_key))
+        # tracked_project_id -> [(received, -seq, email_id)] in ascending order
+        self.by_project = by_project
+        self.with_attachments = sum(1 for email in emails.values() if email.get('attachments'))
+        # Ids added or changed / removed relative to the previous snapshot
+        self.changed = []
+        self.removed = []
+        # Change log of (seq, email_id, kind), kind being 'added', 'changed' or 'removed'; it lives on
+        # the snapshot so a poll always sees the log and the emails it refers to together
+        self.change_seq = 0
+        self.changes = []
+        # Clients that saw a seq below this have missed trimmed entries and must reload
+        self.change_floor = 0
+        # Token clients poll with, the same in every worker process for the same files (see EmailStore),
+        # and the local change seq of each token this process has published
+        self.change_token = None
+        self.change_versions = {}
+
+    def retagged(self, updates):
+        """New snapshot with some emails replaced by copies that differ only in tracked_project_id
+
+        Order, received times and attachment counts are unchanged, so only the
+        affected project lists are rebuilt.
+        """
+        emails = dict(self.emails)
+        emails.update(updates)
+        snapshot = copy.copy(self)
+        snapshot.emails = emails
+        snapshot.by_project = self._patch(self, emails, self.position, self.received, list(updates), [])
+        snapshot.changed, snapshot.removed = list(updates), []
+        return snapshot
+
+    def _newest_first_key(self, i):
+        return _page_key(self.received[i], self.order[i])
+
+    @classmethod
+    def build(cls, emails, previous=None):
+        """Build a snapshot, reusing the parsed times and index of the previous snapshot where possible"""
+        if not all(isinstance(email, EmailRecord) for email in emails.values()):
+            emails = {email_id: email if isinstance(email, EmailRecord) else EmailRecord(email, id=email_id)
+                      for email_id, email in emails.items() if isinstance(email, (dict, EmailRecord))}
+
+        if previous is None:
+            received = cls._parse_times(emails)
+            return cls(emails, received, cls._index(emails, received))
+
+        old_emails = previous.emails
+        changed = [email_id for email_id, email in emails.items() if old_emails.get(email_id) != email]
+        removed = [email_id for email_id in old_emails if email_id not in emails]
+        # Per-project lists break time ties in file order, so unchanged entries can only be kept
+        # while the emails in both files are still in the same order
+        reordered = ([email_id for email_id in previous.order if email_id in emails] !=
+                     [email_id for email_id in emails if email_id in old_emails])
+        if not old_emails or reordered or len(changed) + len(removed) > len(emails) * cls.REBUILD_THRESHOLD:
+            received = cls._parse_times(emails)
+            snapshot = cls(emails, received, cls._index(emails, received))
+            snapshot.changed, snapshot.removed = changed, removed
+            return snapshot
+
+        # Unchanged emails keep their already-parsed times
+        changed_ids = set(changed)
+        received = array('d')
+        for email_id, email in emails.items():
+            if email_id in changed_ids:
+                received.append(_time_or_nan(email))
+            else:
+                received.append(previous.received[previous.position[email_id]])
+        snapshot = cls(emails, received, {})
+        snapshot.by_project = cls._patch(previous, emails, snapshot.position, received, changed, removed)
+        snapshot.changed, snapshot.removed = changed, removed
+        return snapshot
+
+    @staticmethod
+    def _parse_times(emails):
+        return array('d', (_time_or_nan(email) for email in emails.values()))
+
+    @staticmethod
+    def _index(emails, received):
+        by_project = {}
+        for seq, (email_id, email) in enumerate(emails.items()):
+            project_id = email.get('tracked_project_id')
+            if project_id:
+                by_project.setdefault(project_id, []).append((_sort_time(received[seq]), -seq, email_id))
+        for entries in by_project.values():
+            entries.sort()
+        return by_project
+
+    @staticmethod
+    def _patch(previous, emails, position, received, changed, removed):
+        """previous.by_project updated for the changed and removed emails
+
+        position and received are the new snapshot's; entries are keyed on
+        positions in the new file, as _index() would key them.
+        """
+        old_emails = previous.emails
+        stale = set(changed) | set(removed)
+
+        # Only the project lists touched by a change are copied and edited
+        affected = set()
+        for email_id in stale:
+            old = old_emails.get(email_id)
+            if old and old.get('tracked_project_id'):
+                affected.add(old['tracked_project_id'])
+        for email_id in changed:
+            project_id = emails[email_id].get('tracked_project_id')
+            if project_id:
+                affected.add(project_id)
+
+        by_project = dict(previous.by_project)
+        for project_id in affected:
+            # Positions shift when emails are added or removed, so the kept entries are re-keyed too
+            by_project[project_id] = [(received_time, -position[email_id], email_id)
+                                      for received_time, _, email_id in by_project.get(project_id, [])
+                                      if email_id not in stale]
+
+        for email_id in changed:
+            project_id = emails[email_id].get('tracked_project_id')
+            if project_id:
+                seq = position[email_id]
+                by_project[project_id].append((_sort_time(received[seq]), -seq, email_id))
+
+        for project_id in affected:
+            if by_project[project_id]:
+                by_project[project_id].sort()
+            else:
+                del by_project[project_id]
+        return by_project
+
+    def recent_count(self, now=None):
+        """Number of emails received within the last RECENT_DAYS days"""
+        now = now or datetime.now()
+        # Matches the old (now - received).days <= RECENT_DAYS test: anything newer than RECENT_DAYS + 1 days ago
+        cutoff = (now - timedelta(days=RECENT_DAYS + 1)).timestamp()
+        return len(self.received_sorted) - bisect.bisect_right(self.received_sorted, cutoff)
+
+    def sorted_emails(self):
+        """All emails, most recent first"""
+        emails, order = self.emails, self.order
+        return [emails[order[i]] for i in self.newest_first]
+
+    def project_emails(self, project_id):
+        """Emails tracked against a project, most recent first"""
+        emails = self.emails
+        return [emails[entry[2]] for entry in reversed(self.by_project.get(project_id, ()))]
+
+    def page(self, after=None, limit=50):
+        """One page of emails in newest_first order, starting after a (received, email_id) cursor key"""
+        newest = self.newest_first
+        start = 0
+        if after is not None:
+            key = _page_key(*after)
+            low, high = 0, len(newest)
+            while low < high:
+                mid = (low + high) // 2
+                if self._newest_first_key(newest[mid]) <= key:
+                    low = mid + 1
+                else:
+                    high = mid
+            start = low
+
+        positions = newest[start:start + limit]
+        emails = [self.emails[self.order[i]] for i in positions]
+        next_cursor = None
+        if positions and start + limit < len(newest):
+            last = positions[-1]
+            next_cursor = encode_cursor(self.received[last], self.order[last])
+        return emails, next_cursor
+
+    def received_after(self, timestamp):
+        """Emails received after an epoch timestamp, most recent first"""
+        results = []
+        for i in self.newest_first:
+            received = self.received[i]
+            if not received > timestamp:
+                break
+            results.append(self.emails[self.order[i]])
+        return results
+
+
+def _time_or_nan(email):
+    received = parse_received_time(email.get('received_time'))
+    return NO_TIME if received is None else received
+
+
+def _page_key(received, email_id):
+    # Newest first by time, then by id; emails without a time come last
+    if received is None or received != received:
+        return (math.inf, email_id)
+    return (-received, email_id)
+
+
+def encode_cursor(received, email_id):
+    """Opaque keyset cursor for the email after which the next page starts"""
+    if received is not None and received != received:
+        received = None
+    raw = json.dumps([received, email_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return the (received, email_id) key of a cursor; raises ValueError if it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        received, email_id = json.loads(raw)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    if not isinstance(email_id, str) or not (received is None or isinstance(received, (int, float))):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    return received, email_id
+
+
+def _sort_time(received):
+    # NaN does not compare, so unparseable times sort as the oldest
+    return received if received == received else -math.inf
+
+
+class EmailStore(FileBackedStore):
+    """Tracked emails, cached until email_tracking.json changes"""
+
+    # Number of change log entries kept for /api/emails/refresh
+    CHANGE_LOG_LIMIT = 10000
+    # Number of published change tokens remembered, oldest dropped first
+    CHANGE_TOKEN_LIMIT = 1000
+
+    def __init__(self, email_file, journal=None):
+        super().__init__([email_file], journal)
+        self.email_file = email_file
+
+    def _build(self):
+        previous = self._snapshot
+        snapshot = EmailSnapshot.build(load_email_file(self.email_file), previous)
+        if previous is not None:
+            self._record_changes(previous, snapshot)
+        return snapshot
+
+    def _apply(self, snapshot, entries):
+        updates = {}
+        for entry in entries:
+            if entry.get('op') != 'tag':
+                continue
+            email_id = entry['email_id']
+            email = updates.get(email_id) or snapshot.emails.get(email_id)
+            if email is not None:
+                updates[email_id] = EmailRecord(email, tracked_project_id=entry.get('project_id'))
+        if not updates:
+            return copy.copy(snapshot)
+        retagged = snapshot.retagged(updates)
+        self._record_changes(snapshot, retagged)
+        return retagged
+
+    def fold(self, entries):
+        """Write email tagging journal entries into the JSON file (used by journal compaction)"""
+        fold_email_entries(self.email_file, entries)
+
+    def _record_changes(self, previous, snapshot):
+        """Give snapshot the previous change log plus its own changes"""
+        # A copy: the previous snapshot may still be read by other requests
+        changes = list(previous.changes)
+        seq, floor = previous.change_seq, previous.change_floor
+        for email_id in snapshot.changed:
+            seq += 1
+            changes.append((seq, email_id, 'changed' if email_id in previous.emails else 'added'))
+        for email_id in snapshot.removed:
+            seq += 1
+            changes.append((seq, email_id, 'removed'))
+
+        if len(changes) > self.CHANGE_LOG_LIMIT * 2:
+            del changes[:-self.CHANGE_LOG_LIMIT]
+            floor = changes[0][0] - 1
+        snapshot.change_seq, snapshot.changes, snapshot.change_floor = seq, changes, floor
+
+    def _finish(self, snapshot):
+        # The token names the data, not this process's change seq, so pre-forked workers agree on it:
+        # the email file signature plus the journal position read so far
+        token = _signature_token(snapshot.signatures[0])
+        if self.journal is not None:
+            position = snapshot.journal_position
+            token += '-' + ('0' if position is None else f'{position[0]:x}.{position[1]:x}')
+
+        previous = self._snapshot
+        versions = {}
+        if previous is not None:
+            versions = {t: seq for t, seq in previous.change_versions.items() if seq >= snapshot.change_floor}
+        versions.pop(token, None)
+        versions[token] = snapshot.change_seq
+        while len(versions) > self.CHANGE_TOKEN_LIMIT:
+            del versions[next(iter(versions))]
+        snapshot.change_token, snapshot.change_versions = token, versions
+
+    def _journal_changes(self, snapshot, since):
+        """Ids of emails retagged in the journal after another process's token, or None if that can't be told"""
+        if self.journal is None or snapshot.journal_position is None:
+            return None
+        file_token, _, journal_token = since.rpartition('-')
+        if file_token != _signature_token(snapshot.signatures[0]):
+            return None
+        if journal_token == '0':
+            # There was no journal yet, so everything in it is newer
+            position = None
+        else:
+            try:
+                position = tuple(int(part, 16) for part in journal_token.split('.'))
+            except ValueError:
+                return None
+            if len(position) != 2 or position[0] != snapshot.journal_position[0]:
+                return None
+            if position[1] > snapshot.journal_position[1]:
+                return None
+        entries, _ = self.journal.read(position)
+        if entries is None:
+            return None
+        return list(dict.fromkeys(entry['email_id'] for entry in entries if entry.get('op') == 'tag'))
+
+    def changes_since(self, since=None):
+        """Emails added, changed or removed after change token `since`
+
+        Without `since` only the current token is returned, for clients to start from.
+        Tokens this process has published are answered from its change log; another
+        worker's token can still be answered from the shared journal when only
+        emails were retagged since. Otherwise `reset` is set and the client reloads.
+        """
+        snapshot = self.snapshot()
+        if since is not None and since not in snapshot.change_versions and self.refresh():
+            # The token may come from a worker whose watcher saw a change before this one's did
+            snapshot = self.snapshot()
+        delta = {'seq': snapshot.change_token, 'reset': False, 'added': [], 'changed': [], 'removed': []}
+        if since is None or since == snapshot.change_token:
+            return delta
+
+        seq = snapshot.change_versions.get(since)
+        if seq is None:
+            email_ids = self._journal_changes(snapshot, since)
+            if email_ids is None:
+                delta['reset'] = True
+            else:
+                delta['changed'] = [snapshot.emails[email_id] for email_id in email_ids if email_id in snapshot.emails]
+            return delta
+
+        # Only the latest event per email matters
+        latest = {}
+        start = bisect.bisect_left(snapshot.changes, (seq + 1,))
+        for _, email_id, kind in snapshot.changes[start:]:
+            if latest.get(email_id) == 'added' and kind == 'changed':
+                continue
+            latest[email_id] = kind
+
+        for email_id, kind in latest.items():
+            if kind == 'removed':
+                delta['removed'].append(email_id)
+            elif email_id in snapshot.emails:
+                delta[kind].append(snapshot.emails[email_id])
+        return delta
+
+    def received_after(self, timestamp):
+        """Return emails received after an epoch timestamp, most recent first"""
+        return self.snapshot().received_after(timestamp)
+
+    def all(self):
+        """Return a dict of all tracked emails keyed by email id"""
+        return dict(self.snapshot().emails)
+
+    def count(self):
+        """Return the number of tracked emails"""
+        return len(self.snapshot().emails)
+
+    def recent_count(self):
+        """Return the number of emails received within the last RECENT_DAYS days"""
+        return self.snapshot().recent_count()
+
+    def newest_first(self):
+        """Return all tracked emails, most recent first"""
+        return self.snapshot().sorted_emails()
+
+    def for_project(self, project_id):
+        """Return the emails tracked against a project, most recent first"""
+        return self.snapshot().project_emails(project_id)
+
+    def get(self, email_id):
+        """Return a single email by id, or None"""
+        return self.snapshot().emails.get(email_id)
+
+    def page(self, cursor=None, limit=50):
+        """Return (emails, next_cursor) for one page, most recent first; raises ValueError for a bad cursor"""
+        after = decode_cursor(cursor) if cursor else None
+        return self.snapshot().page(after, limit)
+
+    def overview(self):
+        """Totals shown above the email list"""
+        snapshot = self.snapshot()
+        return {
+            'total_emails': len(snapshot.emails),
+            'with_attachments': snapshot.with_attachments,
+            'project_ids': sorted(snapshot.by_project, key=str),
+        }
@@ -0,0 +1,83 @@
+import calendar
+from datetime import date
+
+from analytics import PortfolioAnalytics, PortfolioColumns
+
+NOW = float(calendar.timegm(date(2024, 6, 1).timetuple()))
+
+PROJECTS = [
+    {'id': 'A', 'type': 'Residential', 'status': 'Active', 'quote_value': '$1,000',
+     'start_date': '2024-01-15', 'completion_date': '2024-03-10'},
+    {'id': 'B', 'type': 'Residential', 'status': 'completed', 'quote_value': 2000,
+     'start_date': '2024-02-01', 'completion_date': '2024-02-20'},
+    # No quote and no completion date: counted, worth nothing, in the pipeline to the end
+    {'id': 'C', 'type': 'Commercial', 'status': 'Active', 'quote_value': None,
+     'start_date': '2024-02-10', 'completion_date': None},
+    # Invalid start date and a lower-case status
+    {'id': 'D', 'type': 'Commercial', 'status': 'active', 'quote_value': 500.5,
+     'start_date': '31/02/2024', 'completion_date': '2024-05-01'},
+    # DD/MM start date, completed before it started, no type, status or usable quote
+    {'id': 'E', 'type': None, 'status': None, 'quote_value': 'tbc',
+     'start_date': '01/03/2024', 'completion_date': '2024-02-01'},
+]
+
+
+def test_summary():
+    summary = PortfolioColumns(PROJECTS).summary(NOW)
+    assert summary['totals'] == {'count': 5, 'quoted': 3, 'value': 3500.5, 'average_value': 1166.83}
+    assert summary['by_status'] == {
+        'Active': {'count': 3, 'value': 1500.5},
+        'completed': {'count': 1, 'value': 2000.0},
+        'Unknown': {'count': 1, 'value': 0.0},
+    }
+    assert summary['by_division'] == {
+        'Residential': {'count': 2, 'value': 3000.0},
+        'Commercial': {'count': 2, 'value': 500.5},
+        'Unknown': {'count': 1, 'value': 0.0},
+    }
+    assert summary['by_month'] == {
+        '2024-01': {'count': 1, 'value': 1000.0},
+        '2024-02': {'count': 2, 'value': 2000.0},
+        '2024-03': {'count': 1, 'value': 0.0},
+    }
+    assert summary['pipeline'] == [
+        {'month': '2024-01', 'jobs': 1, 'value': 1000.0},
+        {'month': '2024-02', 'jobs': 3, 'value': 3000.0},
+        {'month': '2024-03', 'jobs': 3, 'value': 1000.0},
+        {'month': '2024-04', 'jobs': 1, 'value': 0.0},
+        {'month': '2024-05', 'jobs': 1, 'value': 0.0},
+    ]
+    assert summary['overdue'] == {
+        'count': 3,
+        'value': 1500.5,
+        'by_division': {
+            'Residential': {'count': 1, 'value': 1000.0},
+            'Commercial': {'count': 1, 'value': 500.5},
+            'Unknown': {'count': 1, 'value': 0.0},
+        },
+    }
+
+
+def test_summary_without_projects():
+    summary = PortfolioColumns([]).summary(NOW)
+    assert summary['totals'] == {'count': 0, 'quoted': 0, 'value': 0.0, 'average_value': None}
+    assert summary['by_month'] == {}
+    assert summary['pipeline'] == []
+    assert summary['overdue'] == {'count': 0, 'value': 0.0, 'by_division': {}}
+
+
+def test_columns_are_rebuilt_only_for_a_new_data_version():
+    analytics = PortfolioAnalytics()
+    loads = []
+
+    def load_projects():
+        loads.append(1)
+        return PROJECTS
+
+    first = analytics.summary('v1', load_projects, today=date(2024, 6, 1))
+    assert analytics.summary('v1', load_projects, today=date(2024, 6, 1)) is first
+    # A new day recomputes the summary from the same columns
+    assert analytics.summary('v1', load_projects, today=date(2024, 6, 2))['as_of'] == '2024-06-02'
+    analytics.summary('v2', load_projects, today=date(2024, 6, 2))
+    assert len(loads) == 2
+    assert analytics.stats() == {'builds': 2, 'hits': 1}
@@ -0,0 +1,45 @@
+from store import EmailSnapshot
+
+TIED = '2024-05-01 09:00:00'
+
+
+def emails(*entries):
+    return {email_id: {'subject': email_id, 'received_time': received, 'tracked_project_id': project_id}
+            for email_id, project_id, received in entries}
+
+
+def assert_same_index(patched, rebuilt):
+    assert patched.by_project == rebuilt.by_project
+    for project_id in rebuilt.by_project:
+        assert patched.project_emails(project_id) == rebuilt.project_emails(project_id)
+
+
+def test_retag_keeps_file_order_for_tied_times():
+    previous = EmailSnapshot.build(emails(('E1', 'P1', TIED), ('E2', 'P2', TIED), ('E3', 'P1', TIED)))
+    current = emails(('E1', 'P1', TIED), ('E2', 'P1', TIED), ('E3', 'P1', TIED))
+
+    rebuilt = EmailSnapshot.build(current)
+    assert [email['subject'] for email in rebuilt.project_emails('P1')] == ['E1', 'E2', 'E3']
+    assert_same_index(EmailSnapshot.build(current, previous), rebuilt)
+    assert_same_index(previous.retagged({'E2': rebuilt.emails['E2']}), rebuilt)
+
+
+def test_patch_rekeys_positions_after_adds_and_removes():
+    entries = [(f'E{i}', 'P1' if i % 2 else 'P2', TIED) for i in range(20)]
+    previous = EmailSnapshot.build(emails(*entries))
+    # Drop one email near the start, retag one and add one, all with the same time
+    entries = entries[:1] + entries[2:]
+    entries[5] = ('E6', 'P1', TIED)
+    entries.insert(3, ('N1', 'P1', TIED))
+    current = emails(*entries)
+
+    patched = EmailSnapshot.build(current, previous)
+    rebuilt = EmailSnapshot.build(current)
+    assert patched.changed and patched.removed
+    assert_same_index(patched, rebuilt)
+
+
+def test_reordered_file_is_rebuilt():
+    previous = EmailSnapshot.build(emails(*[(f'E{i}', 'P1', TIED) for i in range(10)]))
+    current = emails(*[(f'E{i}', 'P1', TIED) for i in reversed(range(10))])
+    assert_same_index(EmailSnapshot.build(current, previous), EmailSnapshot.build(current))
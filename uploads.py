@@ -0,0 +1,310 @@
+"""
+REMC Uploads
+Streaming ingest for files shared to the app: chunked writes to disk, size and
+extension limits, and background hashing, type sniffing and project linking
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import current_app
+from flask.wrappers import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+HASH_CHUNK_SIZE = 1 << 20
+SNIFF_BYTES = 8192
+# Partial uploads left behind by a crash are removed after this long
+STALE_PART_SECONDS = 3600
+
+# Leading bytes of each file type we accept
+SIGNATURES = (
+    (b'%PDF-', 'pdf'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'PK\x03\x04', 'zip'),
+    (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'ole'),
+)
+# Sniffed types an extension may contain (docx/xlsx are zip archives, doc/xls OLE compound files)
+EXTENSION_TYPES = {
+    'pdf': {'pdf'},
+    'png': {'png'},
+    'jpg': {'jpeg'},
+    'jpeg': {'jpeg'},
+    'gif': {'gif'},
+    'doc': {'ole'},
+    'xls': {'ole'},
+    'docx': {'zip'},
+    'xlsx': {'zip'},
+    'txt': {'text'},
+}
+MIME_TYPES = {
+    'pdf': 'application/pdf',
+    'png': 'image/png',
+    'jpeg': 'image/jpeg',
+    'gif': 'image/gif',
+    'zip': 'application/zip',
+    'ole': 'application/x-ole-storage',
+    'text': 'text/plain',
+}
+
+# Candidate project ids in shared titles, text and file names, e.g. R12, C3, RES-4
+PROJECT_ID_RE = re.compile(r'\b[A-Za-z]{1,4}-?\d+\b')
+
+
+def file_extension(filename):
+    return filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+
+
+def allowed_file(filename, allowed_extensions):
+    return file_extension(filename) in allowed_extensions
+
+
+def sniff_type(head):
+    """Type of a file from its first bytes, 'text' for plain text, or None"""
+    for signature, kind in SIGNATURES:
+        if head.startswith(signature):
+            return kind
+    if b'\0' not in head:
+        try:
+            head.decode('utf-8')
+            return 'text'
+        except UnicodeDecodeError as e:
+            # A multi-byte character cut off at the end of the sample is still text
+            if e.start >= len(head) - 3:
+                return 'text'
+    return None
+
+
+class DiskUpload:
+    """Writable file for one multipart part, written straight into the incoming folder"""
+
+    def __init__(self, path, filename, max_size):
+        self.path = path
+        self.filename = filename
+        self.max_size = max_size
+        self.size = 0
+        # Set once the file has been handed to the ingest pool
+        self.claimed = False
+        self._file = open(path, 'w+b')
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_size and self.size > self.max_size:
+            raise RequestEntityTooLarge(f'{self.filename} is larger than {self.max_size // (1024 * 1024)} MB')
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def discard(self):
+        self._file.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class RejectedUpload:
+    """Sink for a part whose extension is not allowed; its data is read and dropped"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        return len(data)
+
+    def seek(self, *args):
+        return 0
+
+    def read(self, *args):
+        return b''
+
+    def readline(self, *args):
+        return b''
+
+    def close(self):
+        pass
+
+
+class UploadRequest(Request):
+    """Request that streams multipart files to disk instead of buffering them
+
+    Allowed files go to UPLOAD_FOLDER/incoming as they arrive, so memory use does
+    not grow with the upload; a file over MAX_FILE_SIZE aborts the request with 413.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        config = current_app.config
+        filename = filename or ''
+        if not allowed_file(filename, config['ALLOWED_EXTENSIONS']):
+            return RejectedUpload(filename)
+
+        incoming = os.path.join(config['UPLOAD_FOLDER'], 'incoming')
+        os.makedirs(incoming, exist_ok=True)
+        upload = DiskUpload(os.path.join(incoming, f'{uuid.uuid4().hex}.part'), filename, config['MAX_FILE_SIZE'])
+        self.__dict__.setdefault('disk_uploads', []).append(upload)
+        return upload
+
+    def discard_unclaimed_uploads(self):
+        """Remove parts that were written but never handed to the ingest pool (e.g. after a 413)"""
+        for upload in self.__dict__.get('disk_uploads', ()):
+            if not upload.claimed:
+                upload.discard()
+
+
+class IngestPool:
+    """Background workers that hash, sniff, link and file away shared uploads
+
+    Files go into the blob store under their SHA-256, so sharing the same photo or
+    plan again does not store it twice. Each upload is recorded one JSON object
+    per line in shared.jsonl.
+    """
+
+    def __init__(self, upload_folder, blob_store, workers=2, find_project=None):
+        self.upload_folder = upload_folder
+        self.blob_store = blob_store
+        self.workers = workers
+        # find_project(texts) -> project id or None
+        self.find_project = find_project
+        self.index_path = os.path.join(upload_folder, 'shared.jsonl')
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.recent_jobs = deque(maxlen=200)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def _pool(self):
+        # Threads don't survive a fork, so each worker process gets its own pool
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    self._sweep_incoming()
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='remc-ingest')
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _sweep_incoming(self):
+        incoming = os.path.join(self.upload_folder, 'incoming')
+        cutoff = time.time() - STALE_PART_SECONDS
+        try:
+            for name in os.listdir(incoming):
+                path = os.path.join(incoming, name)
+                if name.endswith('.part') and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+        except OSError:
+            pass
+
+    def submit(self, upload, context):
+        """Queue a finished DiskUpload; returns the job id at once"""
+        upload.close()
+        upload.claimed = True
+        job = {
+            'id': uuid.uuid4().hex[:16],
+            'filename': upload.filename,
+            'size': upload.size,
+            'status': 'queued',
+            'shared_at': datetime.now().isoformat(timespec='seconds'),
+        }
+        with self._lock:
+            self.pending += 1
+            self.recent_jobs.append(job)
+        self._pool().submit(self._process, job, upload.path, context)
+        return job['id']
+
+    def _process(self, job, path, context):
+        try:
+            self._ingest(job, path, context)
+            job['status'] = 'stored'
+            with self._lock:
+                self.completed += 1
+        except Exception as e:
+            print(f"Error processing shared file {job['filename']}: {e}")
+            job['status'] = 'failed'
+            job['error'] = str(e)
+            with self._lock:
+                self.failed += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def _ingest(self, job, path, context):
+        # One pass over the file: the first chunk is sniffed, every chunk hashed
+        digest = hashlib.sha256()
+        head = b''
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(HASH_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if not head:
+                    head = chunk[:SNIFF_BYTES]
+                digest.update(chunk)
+
+        kind = sniff_type(head)
+        extension = file_extension(job['filename'])
+        if kind not in EXTENSION_TYPES.get(extension, ()):
+            raise ValueError(f'content does not look like a .{extension} file')
+
+        job['sha256'] = digest.hexdigest()
+        job['content_type'] = MIME_TYPES[kind]
+        if self.find_project is not None:
+            job['project_id'] = self.find_project([job['filename']] + [context.get(key, '') for key in
+                                                                        ('title', 'text', 'url')])
+        self.blob_store.put_file(path, digest=job['sha256'], move=True)
+
+        record = dict(job, status='stored', **{key: context.get(key, '') for key in ('title', 'text', 'url')})
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            with open(self.index_path, 'a') as f:
+                f.write(line)
+
+    def recent(self, limit=50):
+        """Most recently stored uploads from the index, newest first"""
+        try:
+            with open(self.index_path) as f:
+                lines = deque(f, maxlen=limit)
+        except OSError:
+            return []
+        records = []
+        for line in reversed(lines):
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+        return records
+
+    def stats(self):
+        return {
+            'pending': self.pending,
+            'completed': self.completed,
+            'failed': self.failed,
+            'workers': self.workers,
+        }
+
+
+def find_project_id(texts, get_project):
+    """First project id mentioned in any of texts that get_project() knows about"""
+    for text in texts:
+        for candidate in PROJECT_ID_RE.findall(text or ''):
+            for project_id in (candidate, candidate.upper()):
+                if get_project(project_id) is not None:
+                    return project_id
+    return None
@@ -0,0 +1,170 @@
+"""
+REMC Data Watcher
+Background thread that reloads file-backed stores as soon as their data files change
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+from store import refresh_all
+
+# inotify event masks (see <sys/inotify.h>)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+EVENT_HEADER = struct.Struct('iIII')
+
+# Wait this long after the last event before reloading, so a file written in several chunks is parsed once
+DEBOUNCE_SECONDS = 0.1
+# Even with inotify, recheck every so often in case an event was missed (e.g. network filesystems)
+SAFETY_INTERVAL = 30.0
+
+
+class _Inotify:
+    """Minimal inotify binding over libc; raises OSError where it is unavailable"""
+
+    def __init__(self):
+        if not sys.platform.startswith('linux'):
+            raise OSError('inotify is only available on Linux')
+        libc_name = ctypes.util.find_library('c') or 'libc.so.6'
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def add_watch(self, directory, mask=WATCH_MASK):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f'inotify_add_watch failed for {directory}')
+        return wd
+
+    def read_names(self, timeout):
+        """Names of the files touched since the last call, waiting up to timeout seconds for the first event"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        names = set()
+        offset = 0
+        while offset < len(data):
+            _, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            names.add(os.fsdecode(data[offset:offset + length].rstrip(b'\0')))
+            offset += length
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class DataWatcher:
+    """Daemon thread that refreshes stores when their files change
+
+    Parsing happens on this thread; the store swaps the finished snapshot in with
+    a single assignment, so request threads keep serving the previous snapshot
+    until the new one is complete and never wait on a reload.
+    """
+
+    def __init__(self, stores, interval=2.0):
+        self.stores = list(stores)
+        # Polling interval when inotify is unavailable
+        self.interval = interval
+        self.mode = None
+        # Process that started the thread; a forked child has to start its own
+        self.pid = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _files(self):
+        """Watched file names grouped by directory"""
+        directories = {}
+        for store in self.stores:
+            for path in store.paths:
+                path = os.path.abspath(path)
+                directories.setdefault(os.path.dirname(path), set()).add(os.path.basename(path))
+        return directories
+
+    def refresh(self):
+        """Reload every store whose files changed; returns the number of new snapshots"""
+        return len(refresh_all(self.stores))
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self.pid = os.getpid()
+        if not self.stores:
+            return
+        # Build the first snapshots before requests stop checking the files themselves
+        self.refresh()
+        try:
+            inotify = _Inotify()
+            for directory in self._files():
+                inotify.add_watch(directory)
+            self.mode = 'inotify'
+            target = lambda: self._run_inotify(inotify)
+        except (OSError, AttributeError) as e:
+            print(f"inotify unavailable, polling data files every {self.interval}s: {e}")
+            self.mode = 'polling'
+            target = self._run_polling
+
+        for store in self.stores:
+            store.watched = True
+        self._thread = threading.Thread(target=target, name='remc-data-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for store in self.stores:
+            store.watched = False
+
+    def _run_polling(self):
+        while not self._stop.wait(self.interval):
+            self.refresh()
+
+    def _run_inotify(self, inotify):
+        watched = set()
+        for names in self._files().values():
+            watched |= names
+        last_refresh = time.monotonic()
+        try:
+            while not self._stop.is_set():
+                names = inotify.read_names(min(1.0, SAFETY_INTERVAL))
+                if names & watched:
+                    # Let the writer finish before parsing, but don't wait forever on a file that never settles
+                    deadline = time.monotonic() + 2.0
+                    while inotify.read_names(DEBOUNCE_SECONDS) and time.monotonic() < deadline:
+                        pass
+                    self.refresh()
+                    last_refresh = time.monotonic()
+                elif time.monotonic() - last_refresh >= SAFETY_INTERVAL:
+                    self.refresh()
+                    last_refresh = time.monotonic()
+        finally:
+            inotify.close()
+
+    def stats(self):
+        return {
+            'mode': self.mode,
+            'running': self._thread is not None and self._thread.is_alive(),
+            'stores': len(self.stores),
+        }